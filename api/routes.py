@@ -1,13 +1,17 @@
 # api/routes.py
 
 from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
 from langgraph.graph.state import StateGraph
 from typing import Annotated, Optional
 
 from api.models import QueryRequest, QueryResponse
 from core.graph import GraphState
 import traceback
-from services.vector_store_service import VectorStoreService 
+from services.vector_store_service import VectorStoreService, course_payload_cache
+from services.async_vector_store_service import AsyncVectorStoreService
+from services.snapshot_service import SnapshotService
 from services.flashcard_service import FlashcardService
 from crawler.login import navegar_e_extrair_cursos_visitando, realizar_login
 import time
@@ -45,9 +49,15 @@ mindmaps_router = APIRouter(
     prefix="/mindmaps",
     tags=["MindMaps"]
 )
+
+snapshots_router = APIRouter(
+    prefix="/snapshots",
+    tags=["Snapshots"]
+)
 # Variáveis globais para instâncias injetadas
 compiled_graph_instance: Optional[StateGraph] = None 
 _vector_store_service_instance: Optional[VectorStoreService] = None 
+_async_vector_store_service_instance: Optional[AsyncVectorStoreService] = None
 
 def set_compiled_graph(graph: StateGraph):
     """Função para injetar o grafo compilado no router."""
@@ -70,6 +80,17 @@ def get_vector_store_service_dependency() -> VectorStoreService:
         raise RuntimeError("VectorStoreService não foi inicializado e injetado corretamente.")
     return _vector_store_service_instance
 
+def set_async_vector_store_service(service: AsyncVectorStoreService):
+    """Função para injetar a instância do AsyncVectorStoreService."""
+    global _async_vector_store_service_instance
+    _async_vector_store_service_instance = service
+
+def get_async_vector_store_service_dependency() -> AsyncVectorStoreService:
+    """Função de dependência para obter a instância do AsyncVectorStoreService."""
+    if _async_vector_store_service_instance is None:
+        raise RuntimeError("AsyncVectorStoreService não foi inicializado e injetado corretamente.")
+    return _async_vector_store_service_instance
+
 
 @router.post("", response_model=QueryResponse)
 async def handle_chat_query(
@@ -89,6 +110,7 @@ async def handle_chat_query(
         "query": request.text,
         "id_course": course_id_from_request, 
         "query_embedding": None,
+        "query_sparse_embedding": None,
         "retrieved_docs": [],
         "context": "",
         "response": None,
@@ -97,7 +119,9 @@ async def handle_chat_query(
     print(f"Estado Inicial Configurado para o Grafo: {initial_state}")
 
     try:
-        final_state = graph.invoke(initial_state)
+        # Executa o grafo fora do event loop para que requisições concorrentes
+        # possam ser agrupadas pelo micro-batching de embeddings.
+        final_state = await run_in_threadpool(graph.invoke, initial_state)
         if final_state.get("error"):
             print(f"Erro retornado pelo grafo: {final_state['error']}")
             return QueryResponse(error=final_state["error"])
@@ -109,11 +133,8 @@ async def handle_chat_query(
 
         sources = []
         retrieved = final_state.get("retrieved_docs", [])
-        for doc_payload in retrieved:
-            source_info = {
-                "source": doc_payload.get("source", "desconhecido"),
-                "page": doc_payload.get("page", -1),
-            }
+        for hit in retrieved:
+            source_info = {"source": hit.source, "page": hit.page}
             if source_info not in sources:
                 sources.append(source_info)
 
@@ -164,14 +185,14 @@ async def login(username: str = Query(...), password: str = Query(...)):
 @retriever_router.post("/{course_id}")
 async def retriever_embeddings_id(
     course_id: str,
-    # Injeta a instância correta do VectorStoreService
-    svc: Annotated[VectorStoreService, Depends(get_vector_store_service_dependency)]
+    # Injeta a instância correta do AsyncVectorStoreService (não bloqueia o event loop)
+    svc: Annotated[AsyncVectorStoreService, Depends(get_async_vector_store_service_dependency)]
 ):
     """Retorna embeddings filtrados por course_id do VectorStoreService."""
     try:
         if not course_id:
             raise HTTPException(status_code=400, detail="ID do curso inválido.")
-        documents_with_embeddings = svc.get_all_by_course_id(course_id_filter=course_id)
+        documents_with_embeddings = await svc.get_all_by_course_id(course_id_filter=course_id)
         
         if not documents_with_embeddings:
             # Alterado para retornar uma lista vazia em vez de 404,
@@ -211,7 +232,7 @@ async def retriever_embeddings_id(
 @flashcards_router.post("/{id_course}")
 async def generate_flashcards(
     id_course: str,
-    vector_size: int = Query(1536, description="Tamanho do vetor para o serviço de flashcards.") # Explicitamente como Query
+    vector_store_svc: Annotated[VectorStoreService, Depends(get_vector_store_service_dependency)]
 ):
     try:
         api_key = os.getenv("GROQ_API_KEY")
@@ -224,10 +245,12 @@ async def generate_flashcards(
             print("!!! ERRO CRÍTICO: settings.llm_model_name não está configurado !!!")
             raise HTTPException(status_code=500, detail="Configuração do servidor incompleta.")
 
-        # Lembre-se da discussão sobre a instância do VectorStoreService usada aqui
-        flashcard_service_instance = FlashcardService(vector_size=vector_size, api_key=api_key)
+        # Usa o vector store compartilhado da aplicação (mesmo backend/cliente das demais rotas)
+        flashcard_service_instance = FlashcardService(vector_store_service=vector_store_svc, api_key=api_key)
         
-        list_flashcards = flashcard_service_instance.create_flashcards(
+        # Leitura do vector store e chamada ao Groq são bloqueantes: fora do event loop
+        list_flashcards = await run_in_threadpool(
+            flashcard_service_instance.create_flashcards,
             id_course=id_course,
             model=settings.llm_model_name
         )
@@ -247,7 +270,7 @@ async def generate_flashcards(
 @mindmaps_router.post("/{id_course}")
 async def generate_mind_map_endpoint(
     id_course: str,
-    vector_store_svc: Annotated[VectorStoreService, Depends(get_vector_store_service_dependency)],
+    vector_store_svc: Annotated[AsyncVectorStoreService, Depends(get_async_vector_store_service_dependency)],
     course_name: str = Query(..., description="Nome do curso para contextualizar o mapa mental.")
 ):
     """Endpoint para gerar mapas mentais com debugging aprimorado."""
@@ -269,10 +292,13 @@ async def generate_mind_map_endpoint(
 
         # 2. Verificar se há dados no vector store
         try:
-            test_docs = vector_store_svc.get_all_by_course_id(id_course)
-            print(f"[ENDPOINT] Vector store contém {len(test_docs)} documentos para o curso {id_course}")
+            # Basta um ponto (só o ID) para saber se o curso tem conteúdo
+            first_page = None
+            async for page in vector_store_svc.iter_course_payloads(id_course, page_size=1, fields=[], max_items=1):
+                first_page = page
+            print(f"[ENDPOINT] Vector store {'contém' if first_page else 'não contém'} documentos para o curso {id_course}")
             
-            if not test_docs:
+            if not first_page:
                 print(f"[ENDPOINT WARNING] Nenhum documento encontrado no vector store para o curso {id_course}")
                 # Retorna estrutura mínima em vez de erro
                 return {
@@ -301,13 +327,16 @@ async def generate_mind_map_endpoint(
             raise HTTPException(status_code=500, detail=f"Erro ao acessar base de dados: {str(vs_error)}")
 
         # 3. Criar serviço e gerar mapa mental
+        # Pré-carrega o conteúdo do curso de forma assíncrona; o MindMapService (síncrono) o lê do cache
+        await vector_store_svc.get_all_by_course_id(id_course)
         mind_map_service_instance = MindMapService(
-            vector_store_service=vector_store_svc,
+            vector_store_service=vector_store_svc.sync,
             api_key=api_key
         )
         
         print(f"[ENDPOINT] Chamando create_mind_map_structure...")
-        mind_map_data = mind_map_service_instance.create_mind_map_structure(
+        mind_map_data = await run_in_threadpool(
+            mind_map_service_instance.create_mind_map_structure,
             id_course=id_course,
             course_name=course_name,
             model=settings.llm_model_name
@@ -339,13 +368,13 @@ async def generate_mind_map_endpoint(
 @mindmaps_router.get("/debug/{id_course}")
 async def debug_mind_map_data(
     id_course: str,
-    vector_store_svc: Annotated[VectorStoreService, Depends(get_vector_store_service_dependency)]
+    vector_store_svc: Annotated[AsyncVectorStoreService, Depends(get_async_vector_store_service_dependency)]
 ):
     """Endpoint para debug - verifica dados disponíveis para um curso."""
     
     try:
         # Teste 1: Verificar documentos no vector store
-        docs = vector_store_svc.get_all_by_course_id(id_course)
+        docs = await vector_store_svc.get_all_by_course_id(id_course)
         
         debug_info = {
             "course_id": id_course,
@@ -353,6 +382,7 @@ async def debug_mind_map_data(
             "groq_api_configured": bool(os.getenv("GROQ_API_KEY")),
             "model_configured": bool(getattr(settings, 'llm_model_name', None)),
             "model_name": getattr(settings, 'llm_model_name', 'NOT_SET'),
+            "course_cache": course_payload_cache.stats(),
             "sample_docs": []
         }
         
@@ -387,4 +417,60 @@ async def debug_mind_map_data(
             "error": str(e),
             "error_type": str(type(e)),
             "course_id": id_course
-        }
\ No newline at end of file
+        }
+
+
+def _snapshot_file_path(file_name: str) -> str:
+    """Caminho do snapshot dentro de SNAPSHOT_DIR (o nome não pode apontar para fora do diretório)."""
+    safe_name = os.path.basename(file_name)
+    if not safe_name or safe_name != file_name or not safe_name.endswith(".npz"):
+        raise HTTPException(status_code=400, detail="Nome de snapshot inválido (esperado '<nome>.npz').")
+    return os.path.join(settings.snapshot_dir, safe_name)
+
+
+@snapshots_router.post("/export")
+async def export_snapshot(
+    vector_store_svc: Annotated[VectorStoreService, Depends(get_vector_store_service_dependency)],
+    course_id: Optional[str] = Query(None, description="Exporta apenas este curso (padrão: coleção inteira)."),
+    file_name: Optional[str] = Query(None, description="Nome do arquivo .npz em SNAPSHOT_DIR.")
+):
+    """Exporta vetores + payloads de um curso ou da coleção para um arquivo em SNAPSHOT_DIR."""
+    file_name = file_name or (f"curso-{course_id}.npz" if course_id else f"{settings.qdrant_collection_name}.npz")
+    path = _snapshot_file_path(file_name)
+    try:
+        return await run_in_threadpool(SnapshotService(vector_store_svc).export, path, course_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Erro ao exportar snapshot: {type(e).__name__} - {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Erro ao exportar snapshot: {e}")
+
+
+@snapshots_router.post("/restore")
+async def restore_snapshot(
+    vector_store_svc: Annotated[VectorStoreService, Depends(get_vector_store_service_dependency)],
+    file_name: str = Query(..., description="Arquivo .npz em SNAPSHOT_DIR."),
+    only_if_empty: bool = Query(False, description="Não restaura se a coleção já tiver pontos.")
+):
+    """Restaura um snapshot de SNAPSHOT_DIR na coleção."""
+    path = _snapshot_file_path(file_name)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Snapshot '{file_name}' não encontrado.")
+    try:
+        return await run_in_threadpool(SnapshotService(vector_store_svc).restore, path, only_if_empty)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Erro ao restaurar snapshot: {type(e).__name__} - {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Erro ao restaurar snapshot: {e}")
+
+
+@snapshots_router.get("/{file_name}")
+async def download_snapshot(file_name: str):
+    """Baixa um snapshot de SNAPSHOT_DIR (ex.: para inicializar outro nó)."""
+    path = _snapshot_file_path(file_name)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Snapshot '{file_name}' não encontrado.")
+    return FileResponse(path, media_type="application/octet-stream", filename=file_name)
@@ -0,0 +1,255 @@
+# benchmarks/embedding_benchmark.py
+"""
+Benchmark de throughput/latência do EmbeddingService.
+
+Varre modelos, número de threads do ONNX Runtime, micro-batching de
+consultas, tamanhos de texto e tamanhos de lote sobre um corpus sintético
+em português e emite os resultados em JSON (docs/s, percentis de latência
+e memória). Cada combinação modelo/threads/micro-batching roda em um
+subprocesso próprio, para que o pico de RSS de uma não contamine a outra.
+O progresso e os logs dos serviços vão para stderr; stdout recebe apenas o
+JSON (quando não há --output), podendo ser redirecionado direto para um arquivo.
+
+Exemplo:
+    python benchmarks/embedding_benchmark.py --batch-sizes 16 64 256 \\
+        --text-lengths 200 1000 2000 --threads 1 4 --query-batching off on \\
+        --output bench_output.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import contextlib
+import platform
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# As configurações e os serviços imprimem mensagens ao serem importados (também
+# nos subprocessos spawn, que reimportam este módulo): mantém stdout só para o JSON
+with contextlib.redirect_stdout(sys.stderr):
+    from config.settings import settings
+    from services.embedding_service import EmbeddingService
+
+PORTUGUESE_VOCABULARY = [
+    "aprendizagem", "conteúdo", "disciplina", "professor", "aluno", "avaliação", "conceito",
+    "teorema", "equação", "derivada", "integral", "função", "matriz", "vetor", "probabilidade",
+    "estatística", "algoritmo", "estrutura", "dados", "programação", "sistema", "rede", "banco",
+    "consulta", "modelo", "análise", "método", "exemplo", "exercício", "definição", "propriedade",
+    "demonstração", "resultado", "capítulo", "seção", "aula", "semestre", "prova", "trabalho",
+    "pesquisa", "fundamento", "aplicação", "problema", "solução", "processo", "tempo", "espaço",
+    "de", "da", "do", "em", "para", "com", "que", "uma", "um", "os", "as", "é", "são", "pelo",
+]
+
+
+def build_corpus(num_texts: int, text_length: int, seed: int) -> List[str]:
+    """Gera textos sintéticos em português com aproximadamente `text_length` caracteres."""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(num_texts):
+        words: List[str] = []
+        size = 0
+        while size < text_length:
+            word = rng.choice(PORTUGUESE_VOCABULARY)
+            words.append(word)
+            size += len(word) + 1
+        corpus.append(" ".join(words)[:text_length].capitalize() + ".")
+    return corpus
+
+
+def peak_rss_mb() -> float:
+    """Pico de memória residente do processo (ru_maxrss é KB no Linux e bytes no macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+def latency_percentiles(latencies_s: List[float]) -> Dict[str, float]:
+    values_ms = np.asarray(latencies_s) * 1000.0
+    return {
+        "p50_ms": float(np.percentile(values_ms, 50)),
+        "p90_ms": float(np.percentile(values_ms, 90)),
+        "p99_ms": float(np.percentile(values_ms, 99)),
+        "max_ms": float(values_ms.max()),
+    }
+
+
+def bench_embed_texts(service: EmbeddingService, corpus: List[str], batch_size: int, repeats: int) -> Dict[str, Any]:
+    rss_before = peak_rss_mb()
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        matrix = service.embed_texts(corpus, batch_size=batch_size)
+        durations.append(time.perf_counter() - start)
+        if len(matrix) != len(corpus):
+            raise RuntimeError(f"embed_texts retornou {len(matrix)} vetores para {len(corpus)} textos.")
+    best = min(durations)
+    return {
+        "docs_per_sec": len(corpus) / best,
+        "best_seconds": best,
+        "mean_seconds": float(np.mean(durations)),
+        # Quanto esta medição elevou o pico do subprocesso (ru_maxrss é cumulativo)
+        "peak_rss_increase_mb": peak_rss_mb() - rss_before,
+    }
+
+
+def bench_embed_single_text(service: EmbeddingService, queries: List[str]) -> Dict[str, Any]:
+    rss_before = peak_rss_mb()
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        if service.embed_single_text(query) is None:
+            raise RuntimeError("embed_single_text retornou None.")
+        latencies.append(time.perf_counter() - start)
+    return {
+        "queries_per_sec": len(latencies) / sum(latencies),
+        **latency_percentiles(latencies),
+        "peak_rss_increase_mb": peak_rss_mb() - rss_before,
+    }
+
+
+def redirect_stdout_to_stderr() -> None:
+    """Inicializador do subprocesso: tudo que for escrito em stdout (inclusive por código nativo) vai para stderr."""
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+
+def run_config(model_name: str,
+               threads: Optional[int],
+               query_batching: bool,
+               text_lengths: List[int],
+               batch_sizes: List[int],
+               num_texts: int,
+               num_queries: int,
+               repeats: int,
+               seed: int) -> Dict[str, Any]:
+    """Mede uma combinação modelo/threads/micro-batching (executada em um subprocesso próprio)."""
+    load_start = time.perf_counter()
+    # Caches desligados: queremos medir a inferência, não acertos de cache
+    service = EmbeddingService(model_name=model_name, threads=threads, enable_caches=False,
+                               enable_query_batching=query_batching)
+    service.embed_single_text("aquecimento")
+    load_seconds = time.perf_counter() - load_start
+    model_rss_mb = peak_rss_mb()
+
+    results: List[Dict[str, Any]] = []
+    for text_length in text_lengths:
+        corpus = build_corpus(num_texts, text_length, seed)
+        queries = build_corpus(num_queries, min(text_length, 200), seed + 1)
+        single = bench_embed_single_text(service, queries)
+        print(f"  embed_single_text len={text_length}: p50={single['p50_ms']:.1f}ms p99={single['p99_ms']:.1f}ms")
+        for batch_size in batch_sizes:
+            batch = bench_embed_texts(service, corpus, batch_size, repeats)
+            print(f"  embed_texts len={text_length} batch={batch_size}: {batch['docs_per_sec']:.1f} docs/s")
+            results.append({
+                "model": model_name,
+                "threads": threads,
+                "query_batching": query_batching,
+                "text_length": text_length,
+                "batch_size": batch_size,
+                "model_load_seconds": load_seconds,
+                "embed_texts": batch,
+                "embed_single_text": single,
+            })
+    return {
+        "model": model_name,
+        "threads": threads,
+        "query_batching": query_batching,
+        "model_load_seconds": load_seconds,
+        "model_rss_mb": model_rss_mb,
+        "peak_rss_mb": peak_rss_mb(),
+        "results": results,
+    }
+
+
+def run_benchmark(model_names: List[str],
+                  thread_counts: List[Optional[int]],
+                  query_batching_modes: List[bool],
+                  text_lengths: List[int],
+                  batch_sizes: List[int],
+                  num_texts: int,
+                  num_queries: int,
+                  repeats: int,
+                  seed: int) -> Dict[str, Any]:
+    configs: List[Dict[str, Any]] = []
+    results: List[Dict[str, Any]] = []
+    for model_name in model_names:
+        for threads in thread_counts:
+            for query_batching in query_batching_modes:
+                print(f"\n=== Modelo: {model_name} | threads: {threads or 'padrão'} | micro-batching: {query_batching} ===")
+                # Um subprocesso novo por combinação: ru_maxrss é o pico do processo inteiro
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=redirect_stdout_to_stderr) as executor:
+                    config = executor.submit(
+                        run_config, model_name, threads, query_batching, text_lengths, batch_sizes,
+                        num_texts, num_queries, repeats, seed
+                    ).result()
+                results.extend(config.pop("results"))
+                configs.append(config)
+    return {
+        "config": {
+            "models": model_names,
+            "threads": thread_counts,
+            "query_batching": query_batching_modes,
+            "text_lengths": text_lengths,
+            "batch_sizes": batch_sizes,
+            "num_texts": num_texts,
+            "num_queries": num_queries,
+            "repeats": repeats,
+            "seed": seed,
+            "embedding_parallel": settings.embedding_parallel,
+            "query_batching_window_ms": settings.query_batching_window_ms,
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+        },
+        # Memória por combinação (cada uma medida em seu próprio subprocesso)
+        "configs": configs,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do EmbeddingService.")
+    parser.add_argument("--models", nargs="+", default=[settings.embedding_model_name])
+    parser.add_argument("--threads", nargs="+", type=int, default=[0],
+                        help="Threads do ONNX Runtime por réplica (0 = padrão do onnxruntime).")
+    parser.add_argument("--query-batching", nargs="+", choices=["off", "on"], default=["off"],
+                        help="Micro-batching de consultas em embed_single_text; 'on' soma a janela "
+                             "QUERY_BATCHING_WINDOW_MS a cada chamada sequencial.")
+    parser.add_argument("--text-lengths", nargs="+", type=int, default=[200, 1000, settings.chunk_size])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[16, 64, 256])
+    parser.add_argument("--num-texts", type=int, default=512)
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Arquivo JSON de saída (padrão: stdout).")
+    args = parser.parse_args()
+
+    # Progresso e prints dos serviços em stderr: stdout fica reservado ao JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_benchmark(
+            model_names=args.models,
+            thread_counts=[t or None for t in args.threads],
+            query_batching_modes=[mode == "on" for mode in args.query_batching],
+            text_lengths=args.text_lengths,
+            batch_sizes=args.batch_sizes,
+            num_texts=args.num_texts,
+            num_queries=args.num_queries,
+            repeats=args.repeats,
+            seed=args.seed,
+        )
+    report_json = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report_json)
+        print(f"\nResultados salvos em {args.output}", file=sys.stderr)
+    else:
+        print(report_json)
+
+
+if __name__ == "__main__":
+    main()
@@ -27,11 +27,36 @@ class Settings(BaseSettings):
         validation_alias='LLM_MODEL_NAME'
     )
 
+    # Carrega/aquece modelos e verifica conexões em segundo plano para acelerar o startup
+    background_warmup: bool = Field(True, validation_alias='BACKGROUND_WARMUP')
+    embedding_warmup_timeout_seconds: float = Field(600.0, validation_alias='EMBEDDING_WARMUP_TIMEOUT_SECONDS')
+
+    # --- Backend de vetores: 'qdrant' ou 'numpy' (busca exata em processo, por curso) ---
+    vector_store_backend: str = Field("qdrant", validation_alias='VECTOR_STORE_BACKEND')
+    numpy_store_path: str = Field("/app/numpy_store", validation_alias='NUMPY_STORE_PATH')
+
     # --- Configurações do Qdrant ---
+    # 'url' (servidor Qdrant), 'memory' (volátil, reingere no startup) ou 'local' (persistido em disco)
     qdrant_mode: str = Field("url", validation_alias='QDRANT_MODE')
+    qdrant_local_path: str = Field("/app/qdrant_data", validation_alias='QDRANT_LOCAL_PATH')
     qdrant_url: Optional[str] = Field(None, validation_alias='QDRANT_URL')
     qdrant_api_key: Optional[str] = Field(None, validation_alias='QDRANT_API_KEY')
     qdrant_collection_name: str = Field("chat-edu", validation_alias='QDRANT_COLLECTION_NAME')
+    # Quantização dos vetores na criação da coleção: 'none', 'scalar' (int8) ou 'binary'
+    qdrant_quantization: str = Field("none", validation_alias='QDRANT_QUANTIZATION')
+    qdrant_quantization_always_ram: bool = Field(True, validation_alias='QDRANT_QUANTIZATION_ALWAYS_RAM')
+    qdrant_search_oversampling: float = Field(2.0, validation_alias='QDRANT_SEARCH_OVERSAMPLING')
+    qdrant_search_rescore: bool = Field(True, validation_alias='QDRANT_SEARCH_RESCORE')
+    # Layout multi-tenant: course_id como índice de tenant e grafo HNSW por curso
+    qdrant_multitenancy: bool = Field(False, validation_alias='QDRANT_MULTITENANCY')
+    qdrant_tenant_payload_m: int = Field(16, validation_alias='QDRANT_TENANT_PAYLOAD_M')
+    qdrant_tenant_disable_global_index: bool = Field(True, validation_alias='QDRANT_TENANT_DISABLE_GLOBAL_INDEX')
+    # Upsert em lotes: lotes simultâneos em voo (modo 'url') e novas tentativas por lote
+    qdrant_upsert_parallelism: int = Field(4, validation_alias='QDRANT_UPSERT_PARALLELISM')
+    qdrant_upsert_max_retries: int = Field(3, validation_alias='QDRANT_UPSERT_MAX_RETRIES')
+    qdrant_upsert_retry_backoff_seconds: float = Field(1.0, validation_alias='QDRANT_UPSERT_RETRY_BACKOFF_SECONDS')
+    # Pool de conexões HTTP do cliente assíncrono (AsyncQdrantClient), compartilhado pelas rotas
+    qdrant_async_max_connections: int = Field(64, validation_alias='QDRANT_ASYNC_MAX_CONNECTIONS')
 
     # --- Configurações do Banco de Dados PostgreSQL (NOVO) ---
     postgres_user: str = Field(..., validation_alias='POSTGRES_USER')
@@ -45,16 +70,75 @@ class Settings(BaseSettings):
         """ Gera a URL de conexão do banco de dados a partir das configurações. """
         return f"postgresql+psycopg2://{self.postgres_user}:{self.postgres_password}@{self.postgres_host}:{self.postgres_port}/{self.postgres_db}"
 
+    # --- Cache em memória dos payloads por curso (get_all_by_course_id) ---
+    course_cache_max_bytes: int = Field(256 * 1024 * 1024, validation_alias='COURSE_CACHE_MAX_BYTES')
+    course_cache_ttl_seconds: float = Field(600.0, validation_alias='COURSE_CACHE_TTL_SECONDS')
+
     # --- Configurações de Processamento de Documentos ---
     pdf_dir: str = Field("/app/data", validation_alias='PDF_DIR') # Caminho dentro do contêiner
     chunk_size: int = Field(2000, validation_alias='CHUNK_SIZE')
     chunk_overlap: int = Field(200, validation_alias='CHUNK_OVERLAP')
 
+    # --- Snapshots da coleção (exportação/importação de vetores + payloads) ---
+    snapshot_dir: str = Field("/app/snapshots", validation_alias='SNAPSHOT_DIR')
+    # Se definido, o arquivo é restaurado no startup quando a coleção está vazia
+    snapshot_restore_path: Optional[str] = Field(None, validation_alias='SNAPSHOT_RESTORE_PATH')
+
+    # --- Manifesto de ingestão incremental (por pasta de curso) ---
+    ingestion_manifest_enabled: bool = Field(True, validation_alias='INGESTION_MANIFEST_ENABLED')
+    # Padrão: <EMBEDDING_CACHE_DIR>/ingest_manifests (volume já persistido)
+    ingestion_manifest_dir: Optional[str] = Field(None, validation_alias='INGESTION_MANIFEST_DIR')
+
+    # --- Pipeline de ingestão (load -> split -> embed -> upsert) ---
+    # Threads por estágio; o upsert usa 1 worker nos modos 'memory'/'local' e no backend numpy
+    ingestion_load_workers: int = Field(2, validation_alias='INGESTION_LOAD_WORKERS')
+    ingestion_split_workers: int = Field(1, validation_alias='INGESTION_SPLIT_WORKERS')
+    ingestion_embed_workers: int = Field(1, validation_alias='INGESTION_EMBED_WORKERS')
+    ingestion_upsert_workers: int = Field(2, validation_alias='INGESTION_UPSERT_WORKERS')
+    # > 0: carrega e divide os PDFs em N processos (substitui os estágios load/split); 0 usa threads.
+    # Só vale para `python ingest_data.py`: o startup do main.py sempre usa threads
+    ingestion_parse_processes: int = Field(0, validation_alias='INGESTION_PARSE_PROCESSES')
+    # Chunks (de vários PDFs) reunidos por chamada ao modelo de embeddings. None = automático:
+    # 2 lotes por worker com EMBEDDING_PARALLEL, senão um PDF por chamada
+    ingestion_embed_group_chunks: Optional[int] = Field(None, validation_alias='INGESTION_EMBED_GROUP_CHUNKS')
+    # PDFs aguardando entre estágios: limita a memória ocupada por páginas/chunks/embeddings
+    ingestion_queue_size: int = Field(4, validation_alias='INGESTION_QUEUE_SIZE')
+
     # --- Configurações do Grafo e Recuperação ---
     retrieval_limit: int = Field(10, validation_alias='RETRIEVAL_LIMIT')
+    # Re-ranqueamento MMR: busca `mmr_candidate_pool` candidatos e escolhe `retrieval_limit` diversos
+    mmr_enabled: bool = Field(False, validation_alias='MMR_ENABLED')
+    mmr_lambda: float = Field(0.5, validation_alias='MMR_LAMBDA')
+    mmr_candidate_pool: int = Field(40, validation_alias='MMR_CANDIDATE_POOL')
+
+    # --- Busca Híbrida (densa + esparsa BM25, fundidas por RRF) ---
+    # Só vale para coleções criadas com vetores esparsos (não é possível adicioná-los a uma coleção existente)
+    hybrid_search_enabled: bool = Field(False, validation_alias='HYBRID_SEARCH_ENABLED')
+    sparse_model_name: str = Field("Qdrant/bm25", validation_alias='SPARSE_MODEL_NAME')
+    sparse_model_language: str = Field("portuguese", validation_alias='SPARSE_MODEL_LANGUAGE')
+    sparse_vector_name: str = Field("bm25", validation_alias='SPARSE_VECTOR_NAME')
+    hybrid_prefetch_limit: int = Field(50, validation_alias='HYBRID_PREFETCH_LIMIT')
 
     # --- Cache para embeddings ---
     embedding_cache_dir: str = Field("/app/embedding_cache", validation_alias="EMBEDDING_CACHE_DIR")
+    embedding_vector_cache_enabled: bool = Field(True, validation_alias="EMBEDDING_VECTOR_CACHE_ENABLED")
+    embedding_vector_cache_max_entries: int = Field(200_000, validation_alias="EMBEDDING_VECTOR_CACHE_MAX_ENTRIES")
+    query_embedding_cache_enabled: bool = Field(True, validation_alias="QUERY_EMBEDDING_CACHE_ENABLED")
+    query_embedding_cache_max_entries: int = Field(2048, validation_alias="QUERY_EMBEDDING_CACHE_MAX_ENTRIES")
+    query_embedding_cache_ttl_seconds: float = Field(3600.0, validation_alias="QUERY_EMBEDDING_CACHE_TTL_SECONDS")
+    embedding_batch_size: int = Field(256, validation_alias="EMBEDDING_BATCH_SIZE")
+    # Threads intra-op do ONNX Runtime por réplica do modelo (None = padrão do onnxruntime)
+    embedding_threads: Optional[int] = Field(None, validation_alias="EMBEDDING_THREADS")
+    # Workers de dados paralelos do fastembed (None = processo único, 0 = todos os núcleos).
+    # Cada chamada sobe um pool novo: a ingestão agrupa PDFs (INGESTION_EMBED_GROUP_CHUNKS) para amortizá-lo
+    embedding_parallel: Optional[int] = Field(None, validation_alias="EMBEDDING_PARALLEL")
+
+    # --- Micro-batching de embeddings de consultas ---
+    query_batching_enabled: bool = Field(True, validation_alias="QUERY_BATCHING_ENABLED")
+    query_batching_max_batch_size: int = Field(32, validation_alias="QUERY_BATCHING_MAX_BATCH_SIZE")
+    query_batching_window_ms: float = Field(5.0, validation_alias="QUERY_BATCHING_WINDOW_MS")
+    # Espera máxima pelo vetor de uma consulta (somada ao warmup enquanto o modelo ainda carrega)
+    query_batching_timeout_seconds: float = Field(30.0, validation_alias="QUERY_BATCHING_TIMEOUT_SECONDS")
 
     # --- Validadores ---
     @field_validator('qdrant_url')
@@ -65,6 +149,29 @@ class Settings(BaseSettings):
             raise ValueError("A variável de ambiente QDRANT_URL é obrigatória quando QDRANT_MODE é 'url'")
         return v
 
+    @field_validator('qdrant_quantization')
+    @classmethod
+    def _check_qdrant_quantization(cls, v: str) -> str:
+        v = v.lower()
+        if v not in ("none", "scalar", "binary"):
+            raise ValueError("QDRANT_QUANTIZATION deve ser 'none', 'scalar' ou 'binary'")
+        return v
+
+    @field_validator('mmr_lambda')
+    @classmethod
+    def _check_mmr_lambda(cls, v: float) -> float:
+        if not 0.0 <= v <= 1.0:
+            raise ValueError("MMR_LAMBDA deve estar entre 0 e 1")
+        return v
+
+    @field_validator('vector_store_backend')
+    @classmethod
+    def _check_vector_store_backend(cls, v: str) -> str:
+        v = v.lower()
+        if v not in ("qdrant", "numpy"):
+            raise ValueError("VECTOR_STORE_BACKEND deve ser 'qdrant' ou 'numpy'")
+        return v
+
 # --- Instanciação Singleton das Configurações ---
 try:
     settings = Settings()
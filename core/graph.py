@@ -4,10 +4,12 @@ from langgraph.graph import StateGraph, END
 import json
 import traceback
 import time 
+import numpy as np
 from services.embedding_service import EmbeddingService
-from services.vector_store_service import VectorStoreService 
+from services.vector_store_service import VectorStoreService, SearchHit
 from services.llm_service import LLMService 
 from core.prompt_utils import format_rag_prompt 
+from core.retrieval_utils import mmr_select
 from config.settings import settings 
 from qdrant_client import models as qdrant_models 
 
@@ -17,7 +19,8 @@ class GraphState(TypedDict):
     query: str
     id_course: Optional[str]  
     query_embedding: Optional[List[float]]
-    retrieved_docs: List[Dict[str, Any]] 
+    query_sparse_embedding: Optional[Any]
+    retrieved_docs: List[SearchHit]
     context: str                    
     response: Optional[str]          
     error: Optional[str]               
@@ -39,6 +42,8 @@ def embed_query_node(state: GraphState, embedding_service: EmbeddingService) ->
         embedding = embedding_service.embed_single_text(query)
         end_time = time.time()
         print(f"DEBUG: embed_single_text RETORNOU em {end_time - start_time:.4f}s.")
+        if embedding_service.query_cache is not None:
+            print(f"DEBUG: Cache de embeddings de consultas: {embedding_service.query_cache.stats()}")
         embedding_type = type(embedding)
 
         if embedding is None or not isinstance(embedding, list) or not all(isinstance(x, float) for x in embedding) or not embedding:
@@ -47,7 +52,9 @@ def embed_query_node(state: GraphState, embedding_service: EmbeddingService) ->
             return {"error": json.dumps({"node": "embed_query", "message": error_msg}), "query_embedding": None}
 
         print(f"Embedding da query gerado com sucesso (dimensão: {len(embedding)}).")
-        return {"query_embedding": embedding, "error": None}
+        # Vetor esparso (BM25) para a busca híbrida; None quando desativada
+        sparse_embedding = embedding_service.embed_sparse_query(query) if settings.hybrid_search_enabled else None
+        return {"query_embedding": embedding, "query_sparse_embedding": sparse_embedding, "error": None}
 
     except Exception as e:
         print(f"Erro EXCEPCIONAL no embed_query_node:")
@@ -88,14 +95,21 @@ def retrieve_documents_node(state: GraphState, vector_store_service: VectorStore
         print(f"DEBUG: Buscando documentos com embedding (primeiros 5): {str(query_embedding)[:100]}... e filtro: {qdrant_filter_obj}")
         
         # Passa o objeto de filtro construído para o método search
-        retrieved_payloads = vector_store_service.search(
+        # Com MMR, busca um pool maior de candidatos (com vetores) para escolher um top-k diverso
+        use_mmr = settings.mmr_enabled
+        retrieved_hits = vector_store_service.search(
             query_vector=query_embedding, 
-            limit=settings.retrieval_limit,
-            filter=qdrant_filter_obj 
+            limit=max(settings.retrieval_limit, settings.mmr_candidate_pool) if use_mmr else settings.retrieval_limit,
+            filter=qdrant_filter_obj,
+            sparse_vector=state.get("query_sparse_embedding"),
+            with_vectors=use_mmr
         )
-        print(f"Recuperados {len(retrieved_payloads)} payloads do Qdrant.")
+        print(f"Recuperados {len(retrieved_hits)} documentos do Qdrant.")
 
-        context_texts = [payload.get('text') for payload in retrieved_payloads if payload and payload.get('text')] 
+        if use_mmr and retrieved_hits:
+            retrieved_hits = rerank_mmr(query_embedding, retrieved_hits, settings.retrieval_limit, settings.mmr_lambda)
+
+        context_texts = [hit.text for hit in retrieved_hits if hit.text]
 
         if not context_texts:
             print("Aviso: Nenhum texto encontrado nos payloads recuperados. Contexto estará vazio.")
@@ -105,7 +119,7 @@ def retrieve_documents_node(state: GraphState, vector_store_service: VectorStore
             print(f"DEBUG: Contexto montado (primeiros 100 chars): {context[:100]}...")
 
         return {
-            "retrieved_docs": retrieved_payloads,
+            "retrieved_docs": retrieved_hits,
             "context": context,
             "error": None
         }
@@ -117,6 +131,19 @@ def retrieve_documents_node(state: GraphState, vector_store_service: VectorStore
         return {"retrieved_docs": [], "context": "", "error": json.dumps({"node": "retrieve_documents", "message": f"Exceção na busca vetorial: {str(e)}", "details": detailed_error})}
 
 
+def rerank_mmr(query_embedding: List[float], hits: List[SearchHit], k: int, lambda_mult: float) -> List[SearchHit]:
+    """Escolhe `k` resultados diversos via MMR; os vetores são descartados em seguida para manter o estado enxuto."""
+    if len(hits) <= k or any(hit.vector is None for hit in hits):
+        selected = hits[:k]
+    else:
+        positions = mmr_select(query_embedding, np.stack([hit.vector for hit in hits]), k, lambda_mult)
+        selected = [hits[p] for p in positions]
+        print(f"DEBUG: MMR (lambda={lambda_mult}) escolheu {len(selected)} de {len(hits)} candidatos.")
+    for hit in selected:
+        hit.vector = None
+    return selected
+
+
 def generate_response_node(state: GraphState, llm_service: LLMService) -> Dict[str, Any]:
     """Nó para gerar a resposta final usando o LLM."""
     print('--- Nó: Generate Response ---')
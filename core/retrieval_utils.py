@@ -0,0 +1,40 @@
+from typing import List
+import numpy as np
+
+
+def mmr_select(query_vector: np.ndarray | List[float],
+               candidate_vectors: np.ndarray,
+               k: int,
+               lambda_mult: float = 0.5) -> List[int]:
+    """
+    Seleciona `k` candidatos por Maximal Marginal Relevance: a cada passo
+    escolhe o que maximiza `lambda * sim(consulta) - (1 - lambda) * max sim(já escolhidos)`.
+    `lambda_mult=1` reproduz o ranking por relevância; valores menores
+    favorecem diversidade. Retorna as posições escolhidas, em ordem.
+    """
+    vectors = np.asarray(candidate_vectors, dtype=np.float32)
+    if vectors.ndim != 2 or not len(vectors) or k <= 0:
+        return []
+    query = np.asarray(query_vector, dtype=np.float32)
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    query = query / (np.linalg.norm(query) or 1.0)
+
+    relevance = vectors @ query
+    # Similaridade entre candidatos calculada uma vez (o pool é pequeno: dezenas de vetores)
+    similarity = vectors @ vectors.T
+
+    first = int(np.argmax(relevance))
+    selected = [first]
+    max_similarity = similarity[first].copy()
+    available = np.ones(len(vectors), dtype=bool)
+    available[first] = False
+    for _ in range(min(k, len(vectors)) - 1):
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        chosen = int(np.argmax(scores))
+        selected.append(chosen)
+        available[chosen] = False
+        np.maximum(max_similarity, similarity[chosen], out=max_similarity)
+    return selected
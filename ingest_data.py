@@ -3,24 +3,46 @@ import time
 import os
 import re  # Para extrair o ID da pasta com regex
 import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Optional, Dict, List, Any
 
 # Importações dos seus módulos e serviços
 from config.settings import settings
-from services.document_service import load_and_split_pdf
+from services.document_service import load_pdf, split_documents, parse_pdf, parsed_to_documents
 from services.embedding_service import EmbeddingService
 # Importe o VectorStoreService atualizado (que espera id_course no upsert)
-from services.vector_store_service import VectorStoreService
+from services.vector_store_service import VectorStoreService, create_vector_store_service, document_point_id
+from services.ingestion_manifest import IngestionManifest
+from services.ingestion_pipeline import StagedPipeline, PipelineStage, PdfTask
 # Se VectorStoreService ainda espera name_course, você pode passar None ou ""
 # ou ajustar a chamada abaixo e a definição no VectorStoreService.
 
-def run_ingestion():
+def run_ingestion(embedding_service: Optional[EmbeddingService] = None,
+                  vector_store_service: Optional[VectorStoreService] = None,
+                  skip_indexed_sources: bool = False,
+                  parse_processes: int = 0):
     """
     Executa o processo de ingestão completo.
     Itera sobre as subpastas no diretório PDF_DIR, extrai o course_id
     do nome da pasta (ex: 'Curso-4592' -> '4592'), processa os PDFs
     dentro de cada pasta e insere os chunks e embeddings no Qdrant
     com o 'course_id' correto no payload.
+
+    Os serviços podem ser injetados (ex.: pelo main.py no startup).
+
+    Com INGESTION_MANIFEST_ENABLED (padrão), cada curso tem um manifesto
+    (hash/tamanho/mtime, chunking, modelo e IDs dos pontos por PDF): PDFs
+    inalterados e presentes no índice são pulados, PDFs alterados são
+    reprocessados e seus pontos obsoletos removidos, e PDFs (ou pastas de
+    curso) removidos têm seus pontos apagados. Sem manifesto, vale
+    `skip_indexed_sources`: PDFs que já possuem pontos no índice são ignorados.
+
+    `parse_processes` > 0 carrega e divide os PDFs em um pool de processos
+    ('spawn'). Como cada worker reimporta o `__main__` de quem chamou, só o
+    ponto de entrada deste script o habilita (INGESTION_PARSE_PROCESSES);
+    o startup do main.py usa os estágios em threads.
     """
     print("--- Iniciando Processo de Ingestão por Curso (ID da Pasta) ---")
     start_time_total = time.time()
@@ -38,19 +60,21 @@ def run_ingestion():
     # --- 2. Inicialização dos Serviços ---
     try:
         print("Inicializando serviços...")
-        embedding_service = EmbeddingService()
-        vector_size = embedding_service.get_embedding_dimension()
-        vector_store_service = VectorStoreService(vector_size=vector_size)
-        vector_store_service._setup_collection()
+        if embedding_service is None:
+            embedding_service = EmbeddingService()
+        if vector_store_service is None:
+            vector_size = embedding_service.get_embedding_dimension()
+            vector_store_service = create_vector_store_service(vector_size=vector_size)
         print("Serviços inicializados com sucesso.")
     except Exception as e:
         print(f"Erro crítico ao inicializar serviços: {e}. Abortando.")
         traceback.print_exc()
         return
 
-    # --- 3. Processamento por Pasta de Curso ---
+    # --- 3. Planejamento por Pasta de Curso ---
     total_pdfs_processed = 0
     total_chunks_ingested = 0
+    total_embedding_seconds = 0.0
     courses_processed_count = 0
     courses_failed = [] # Lista para rastrear IDs de cursos com falha
 
@@ -68,6 +92,10 @@ def run_ingestion():
          return
 
     print(f"Encontradas {len(course_folders_found)} subpastas. Iniciando processamento...")
+    use_manifest = settings.ingestion_manifest_enabled
+    seen_course_ids = set()
+    tasks: List[PdfTask] = []
+    course_states: Dict[str, Dict[str, Any]] = {}
 
     for course_dir_path in course_folders_found:
         folder_name = course_dir_path.name # Ex: "Curso-4592"
@@ -76,102 +104,221 @@ def run_ingestion():
         match = re.search(r'\d+$', folder_name)
         if match:
             course_id = match.group(0) # Ex: "4592"
-            print(f"\n--- Processando Pasta: {folder_name} | ID Extraído: {course_id} ---")
+            print(f"\n--- Planejando Pasta: {folder_name} | ID Extraído: {course_id} ---")
         else:
             print(f"\nAviso: Não foi possível extrair um ID numérico do nome da pasta '{folder_name}'. Pulando esta pasta.")
             continue # Pula para a próxima pasta
 
-        start_time_course = time.time()
+        seen_course_ids.add(course_id)
+        manifest: Optional[IngestionManifest] = None
+        plan = None
 
         # Listar PDFs DENTRO da pasta do curso atual
         try:
             pdf_files_in_course = list(course_dir_path.glob("*.pdf"))
+            if use_manifest:
+                manifest = IngestionManifest(course_id, vector_store_service.collection_name)
+                plan = manifest.plan(pdf_files_in_course)
+                # Inalterado no manifesto mas ausente do índice (ex.: modo 'memory' recém-iniciado): reprocessa
+                missing = [p for p in plan.unchanged if not vector_store_service.has_source(course_id, str(p))]
+                plan.unchanged = [p for p in plan.unchanged if p not in missing]
+                plan.new.extend(missing)
+                print(f"Manifesto do curso {course_id}: {len(plan.unchanged)} inalterados, {len(plan.changed)} alterados, "
+                      f"{len(plan.new)} novos/ausentes do índice, {len(plan.removed)} removidos.")
+                for removed_name in plan.removed:
+                    if vector_store_service.delete_points(course_id, manifest.point_ids(removed_name)):
+                        manifest.forget(removed_name)
+                if plan.removed:
+                    manifest.save()
+                pdf_files_in_course = plan.pending
+                if not pdf_files_in_course:
+                    print(f"Nenhum PDF novo ou alterado para o curso {course_id}. Nada a fazer.")
+                    continue
             if not pdf_files_in_course:
                 print(f"Nenhum arquivo PDF encontrado em '{course_dir_path}'. Pulando para o próximo curso.")
                 continue
             print(f"Encontrados {len(pdf_files_in_course)} PDFs para o curso {course_id}.")
+            if skip_indexed_sources and not use_manifest:
+                pending_pdfs = [p for p in pdf_files_in_course if not vector_store_service.has_source(course_id, str(p))]
+                skipped_count = len(pdf_files_in_course) - len(pending_pdfs)
+                if skipped_count:
+                    print(f"{skipped_count} PDFs já indexados para o curso {course_id}; ignorando-os.")
+                pdf_files_in_course = pending_pdfs
+                if not pdf_files_in_course:
+                    print(f"Todos os PDFs do curso {course_id} já estão no índice. Nada a fazer.")
+                    continue
         except Exception as e:
             print(f"Erro ao listar PDFs na pasta '{course_dir_path}': {e}. Pulando este curso.")
             courses_failed.append(course_id)
             continue
 
-        # --- 3.1 Carregar e Dividir Documentos do Curso Atual ---
-        course_documents = [] # Lista para guardar chunks DESTE curso
-        print("Carregando e dividindo documentos do curso...")
-        pdf_processing_failed = False
-        for pdf_path in pdf_files_in_course:
-            print(f"  Processando: {pdf_path.name}...")
-            try:
-                # Certifique-se que load_and_split_pdf aceita string ou Path
-                documents_from_single_pdf = load_and_split_pdf(str(pdf_path))
-                if documents_from_single_pdf:
-                    course_documents.extend(documents_from_single_pdf)
-                    print(f"    -> {len(documents_from_single_pdf)} chunks adicionados.")
-                else:
-                    print(f"    -> Aviso: Nenhum chunk gerado para {pdf_path.name}.")
-            except Exception as e:
-                 print(f"    -> ERRO CRÍTICO ao processar {pdf_path.name}: {e}")
-                 traceback.print_exc()
-                 # Decide se quer parar o curso ou apenas pular o arquivo
-                 # Aqui, vamos marcar que houve falha neste curso e continuar com os outros PDFs se possível
-                 pdf_processing_failed = True
-                 # break # Descomente para parar de processar PDFs deste curso no primeiro erro
-
-        if not course_documents:
-            print("Nenhum chunk válido gerado para este curso após processar os PDFs. Pulando ingestão para este curso.")
-            if pdf_processing_failed: courses_failed.append(course_id) # Marcar falha se erro ocorreu
-            continue # Pula para o próximo curso
-
-        print(f"Total de chunks para o curso {course_id}: {len(course_documents)}")
-
-        # --- 3.2 Gerar Embeddings para os Chunks do Curso Atual ---
-        print("Gerando embeddings para os chunks do curso...")
-        try:
-            # Extrai o conteúdo textual para o serviço de embedding
-            course_doc_contents = [doc.page_content for doc in course_documents]
-            course_embeddings = embedding_service.embed_texts(course_doc_contents)
-
-            # Validação importante
-            if not course_embeddings or len(course_embeddings) != len(course_documents):
-                print("Erro: Falha ao gerar embeddings ou contagem incompatível com chunks. Pulando ingestão para este curso.")
-                courses_failed.append(course_id)
-                continue
-            print(f"Embeddings gerados para o curso: {len(course_embeddings)}")
+        course_states[course_id] = {
+            "manifest": manifest,
+            "plan": plan,
+            "pending": len(pdf_files_in_course),
+            "chunks": 0,
+            "embed_seconds": 0.0,
+            "failed": False,
+            "start_time": time.time(),
+        }
+        tasks.extend(
+            PdfTask(course_id=course_id, pdf_path=pdf_path,
+                    previous_point_ids=manifest.point_ids(pdf_path.name) if manifest is not None else [])
+            for pdf_path in pdf_files_in_course
+        )
 
-        except Exception as e:
-            print(f"Erro CRÍTICO ao gerar embeddings para o curso {course_id}: {e}. Pulando ingestão.")
-            traceback.print_exc()
-            courses_failed.append(course_id)
-            continue
+    # --- 3.1 a 3.3 Pipeline: carregar -> dividir -> embedar -> inserir no Qdrant ---
+    def load_stage(task: PdfTask):
+        print(f"  Processando: {task.pdf_path.name} (curso {task.course_id})...")
+        task.pages = load_pdf(str(task.pdf_path))
 
-        # --- 3.3 Inserir Chunks e Embeddings no Qdrant com Metadados ---
-        print(f"Inserindo/Atualizando {len(course_documents)} pontos no Qdrant para o curso {course_id}...")
-        try:
-            # Chamada para o método upsert, passando o ID do curso extraído
-            # Certifique-se que a assinatura do método em VectorStoreService corresponde
-            # (removido name_course se você decidiu omiti-lo)
+    def split_stage(task: PdfTask):
+        task.documents = split_documents(task.pages)
+        task.pages = None
+        if not task.documents:
+            print(f"    -> Aviso: Nenhum chunk gerado para {task.pdf_path.name}.")
+
+    parse_executor: Optional[ProcessPoolExecutor] = None
+
+    def parse_stage(task: PdfTask):
+        # Carrega e divide em outro processo; só os chunks compactos voltam por pickle
+        print(f"  Processando: {task.pdf_path.name} (curso {task.course_id})...")
+        task.documents = parsed_to_documents(parse_executor.submit(parse_pdf, str(task.pdf_path)).result())
+        if not task.documents:
+            print(f"    -> Aviso: Nenhum chunk gerado para {task.pdf_path.name}.")
+
+    def embed_stage(group: List[PdfTask]):
+        # Uma chamada ao modelo para os chunks de todos os PDFs do grupo, repartida depois por PDF
+        group = [task for task in group if task.documents]
+        if not group:
+            return
+        doc_contents = [doc.page_content for task in group for doc in task.documents]
+        embeddings = embedding_service.embed_texts(doc_contents)
+        if len(embeddings) != len(doc_contents):
+            raise RuntimeError(f"{len(embeddings)} embeddings gerados para {len(doc_contents)} chunks")
+        sparse_embeddings = None
+        if vector_store_service.hybrid_enabled:
+            # Sem os vetores esparsos os pontos ficariam fora da busca híbrida: falha o grupo
+            # (os PDFs não entram no manifesto e são reprocessados na próxima execução)
+            sparse_embeddings = embedding_service.embed_sparse_texts(doc_contents)
+            if sparse_embeddings is None or len(sparse_embeddings) != len(doc_contents):
+                generated = 0 if sparse_embeddings is None else len(sparse_embeddings)
+                raise RuntimeError(f"busca híbrida ativa, mas {generated} embeddings esparsos gerados para {len(doc_contents)} chunks")
+        offset = 0
+        for task in group:
+            end = offset + len(task.documents)
+            task.embeddings = embeddings[offset:end]
+            task.sparse_embeddings = sparse_embeddings[offset:end] if sparse_embeddings is not None else None
+            offset = end
+
+    def upsert_stage(task: PdfTask):
+        if task.documents:
             success = vector_store_service.upsert_documents(
-                documents=course_documents,
-                embeddings=course_embeddings,
-                id_course=course_id
-                # batch_size=100 # Pode adicionar se o método aceitar
+                documents=task.documents,
+                embeddings=task.embeddings,
+                id_course=task.course_id,
+                sparse_embeddings=task.sparse_embeddings
             )
-        except Exception as e:
-             print(f"Erro CRÍTICO durante chamada ao upsert_documents para o curso {course_id}: {e}")
-             traceback.print_exc()
-             success = False # Marcar como falha
-
-        end_time_course = time.time()
-        duration_course = end_time_course - start_time_course
-
-        if success:
-            print(f"--- Ingestão para o curso {course_id} Concluída com Sucesso em {duration_course:.2f} segundos ---")
-            total_pdfs_processed += len(pdf_files_in_course)
-            total_chunks_ingested += len(course_documents)
-            courses_processed_count += 1
-        else:
-            print(f"--- Ingestão para o curso {course_id} Falhou após {duration_course:.2f} segundos ---")
-            courses_failed.append(course_id) # Adiciona ID à lista de falhas
+            if not success:
+                raise RuntimeError("upsert_documents reportou falha")
+        task.point_ids = [document_point_id(doc, task.course_id) for doc in (task.documents or [])]
+        # Chunks que deixaram de existir na nova versão do PDF (ou com outro chunking). Removidos aqui,
+        # na mesma thread do upsert: o cliente local do Qdrant não aceita escritas concorrentes
+        stale_point_ids = sorted(set(task.previous_point_ids) - set(task.point_ids))
+        if stale_point_ids:
+            vector_store_service.delete_points(task.course_id, stale_point_ids)
+        task.embeddings = None
+        task.sparse_embeddings = None
+        task.success = True
+
+    # EMBEDDING_PARALLEL só tem efeito quando uma chamada tem mais textos que o lote, e o fastembed
+    # sobe um pool novo (recarregando o modelo) a cada chamada: o estágio de embedding junta PDFs
+    # até ter lotes para todos os workers, amortizando esse custo
+    embed_group_chunks = settings.ingestion_embed_group_chunks
+    if embed_group_chunks is None:
+        parallel_workers = (settings.embedding_parallel or os.cpu_count() or 1) if settings.embedding_parallel is not None else 0
+        embed_group_chunks = 2 * settings.embedding_batch_size * parallel_workers
+    # O cliente local do Qdrant (e o backend NumPy) não aceitam escritas concorrentes
+    upsert_workers = 1 if vector_store_service.is_local else settings.ingestion_upsert_workers
+    parse_processes = min(parse_processes, len(tasks))
+    if parse_processes > 0:
+        # 'spawn': os workers não herdam as threads do pipeline nem o modelo de embeddings já carregado
+        parse_executor = ProcessPoolExecutor(max_workers=parse_processes, mp_context=multiprocessing.get_context("spawn"))
+        # Uma thread por processo mantém o pool ocupado; a fila limitada segura o restante
+        parse_stages = [PipelineStage("parse", parse_stage, parse_processes)]
+    else:
+        parse_stages = [
+            PipelineStage("load", load_stage, settings.ingestion_load_workers),
+            PipelineStage("split", split_stage, settings.ingestion_split_workers),
+        ]
+    pipeline = StagedPipeline(
+        stages=[
+            *parse_stages,
+            PipelineStage("embed", embed_stage, settings.ingestion_embed_workers,
+                          group_target=max(1, embed_group_chunks),
+                          group_size=lambda task: len(task.documents or [])),
+            PipelineStage("upsert", upsert_stage, upsert_workers),
+        ],
+        queue_size=settings.ingestion_queue_size
+    )
+    # Com vários workers de embedding os tempos por PDF se sobrepõem: a soma não é tempo de relógio
+    embed_workers = max(1, settings.ingestion_embed_workers)
+    embed_time_note = f" (somado entre {embed_workers} workers)" if embed_workers > 1 else ""
+    embed_rate_note = " por worker" if embed_workers > 1 else ""
+    if tasks:
+        print(f"\nProcessando {len(tasks)} PDFs de {len(course_states)} cursos em pipeline "
+              f"(workers: {', '.join(f'{st.name}={st.workers}' for st in pipeline.stages)})...")
+
+    try:
+        for task in pipeline.run(tasks):
+            state = course_states[task.course_id]
+            state["pending"] -= 1
+            if task.success:
+                chunk_count = len(task.documents)
+                print(f"    -> {task.pdf_path.name}: {chunk_count} chunks indexados para o curso {task.course_id}.")
+                total_pdfs_processed += 1
+                state["chunks"] += chunk_count
+                state["embed_seconds"] += task.stage_seconds.get("embed", 0.0)
+                manifest = state["manifest"]
+                if manifest is not None:
+                    manifest.record(task.pdf_path, task.point_ids, state["plan"].stats.get(task.pdf_path.name))
+            else:
+                print(f"    -> ERRO CRÍTICO ao processar {task.pdf_path.name}: {task.error}")
+                state["failed"] = True
+            task.documents = None
+
+            if state["pending"] == 0:
+                # Último PDF do curso: grava o manifesto e resume o curso
+                if state["manifest"] is not None:
+                    state["manifest"].save()
+                duration_course = time.time() - state["start_time"]
+                total_chunks_ingested += state["chunks"]
+                total_embedding_seconds += state["embed_seconds"]
+                if state["embed_seconds"] > 0:
+                    chunks_per_second = state["chunks"] / state["embed_seconds"]
+                    print(f"Embeddings gerados para o curso {task.course_id}: {state['chunks']} em {state['embed_seconds']:.2f}s{embed_time_note} ({chunks_per_second:.1f} chunks/s{embed_rate_note})")
+                if not state["failed"]:
+                    print(f"--- Ingestão para o curso {task.course_id} Concluída com Sucesso em {duration_course:.2f} segundos ({state['chunks']} chunks) ---")
+                    courses_processed_count += 1
+                else:
+                    print(f"--- Ingestão para o curso {task.course_id} Falhou (parcialmente) após {duration_course:.2f} segundos ---")
+                    courses_failed.append(task.course_id)
+    finally:
+        if parse_executor is not None:
+            parse_executor.shutdown(cancel_futures=True)
+    if tasks:
+        print(f"Tempo ocupado por estágio do pipeline: {pipeline.report()}")
+
+    # --- 3.4 Pastas de curso removidas: apaga os pontos registrados no manifesto ---
+    if use_manifest:
+        for removed_course_id in IngestionManifest.tracked_course_ids(vector_store_service.collection_name):
+            if removed_course_id in seen_course_ids:
+                continue
+            removed_manifest = IngestionManifest(removed_course_id, vector_store_service.collection_name)
+            removed_ids = [pid for name in removed_manifest.files for pid in removed_manifest.point_ids(name)]
+            print(f"Pasta do curso {removed_course_id} não existe mais; removendo {len(removed_ids)} pontos.")
+            if vector_store_service.delete_points(removed_course_id, removed_ids):
+                removed_manifest.delete()
 
     # --- 4. Resumo Final da Ingestão ---
     end_time_total = time.time()
@@ -181,6 +328,9 @@ def run_ingestion():
     print(f"Total de Pastas de Curso Processadas com Sucesso: {courses_processed_count}")
     print(f"Total de Arquivos PDF Lidos: {total_pdfs_processed}")
     print(f"Total de Chunks Ingeridos/Atualizados no Qdrant: {total_chunks_ingested}")
+    if total_embedding_seconds > 0:
+        print(f"Tempo total de embeddings: {total_embedding_seconds:.2f}s{embed_time_note} ({total_chunks_ingested / total_embedding_seconds:.1f} chunks/s{embed_rate_note})")
+    print(f"Cache de embeddings: {embedding_service.get_cache_stats()}")
     if courses_failed:
         # Usar set para mostrar IDs únicos que falharam
         unique_failed_courses = sorted(list(set(courses_failed)))
@@ -191,4 +341,4 @@ def run_ingestion():
 
 # --- Ponto de Entrada Principal ---
 if __name__ == "__main__":
-    run_ingestion()
\ No newline at end of file
+    run_ingestion(parse_processes=settings.ingestion_parse_processes)
\ No newline at end of file
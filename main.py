@@ -4,7 +4,6 @@ from fastapi.middleware.cors import CORSMiddleware
 import os
 import traceback
 import time
-from pathlib import Path
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -18,9 +17,11 @@ except Exception as config_error:
     exit(1) 
 
 from services.embedding_service import EmbeddingService
-from services.vector_store_service import VectorStoreService
+from services.vector_store_service import create_vector_store_service
+from services.async_vector_store_service import AsyncVectorStoreService
+from services.snapshot_service import SnapshotService
 from services.llm_service import LLMService
-from services.document_service import load_and_split_pdf
+from ingest_data import run_ingestion
 from core.graph import create_compiled_graph
 from api.routes import ( 
     router as chat_router,
@@ -28,8 +29,10 @@ from api.routes import (
     retriever_router,
     flashcards_router,
     mindmaps_router, 
+    snapshots_router,
     set_compiled_graph,
-    set_vector_store_service
+    set_vector_store_service,
+    set_async_vector_store_service
 )
 
 ALLOWED_ORIGINS = [
@@ -53,64 +56,39 @@ try:
     print("Inicializando serviços...")
     embedding_service = EmbeddingService()
     vector_size = embedding_service.get_embedding_dimension()
-    vector_store_service = VectorStoreService(vector_size=vector_size) 
+    vector_store_service = create_vector_store_service(vector_size=vector_size)
+    async_vector_store_service = AsyncVectorStoreService(vector_store_service)
     llm_service = LLMService()
     print("Serviços principais inicializados.")
 
-    # --- Lógica de Ingestão de Dados (In-Memory Mode) ---
-    if settings.qdrant_mode == 'memory':
-        print(f"\n--- Iniciando Ingestão In-Memory (Modo '{settings.qdrant_mode}') ---")
-        ingestion_start_time = time.time()
-
-        pdf_directory = Path(pdf_directory_path_str)
-        pdf_files_found = list(pdf_directory.glob("*.pdf"))
-
-        all_documents = []
-        if not pdf_files_found:
-            print(f"Aviso: Nenhum arquivo .pdf encontrado no diretório '{pdf_directory}'. O Vector Store estará vazio se não houver ingestão prévia.")
+    # --- Restauração de Snapshot (se configurado e a coleção estiver vazia) ---
+    snapshot_restored = False
+    if settings.snapshot_restore_path:
+        if settings.vector_store_backend != 'qdrant':
+            print(f"Aviso: SNAPSHOT_RESTORE_PATH ignorado; snapshots exigem o backend 'qdrant' (atual: '{settings.vector_store_backend}').")
+        elif os.path.isfile(settings.snapshot_restore_path):
+            print(f"\n--- Restaurando snapshot {settings.snapshot_restore_path} ---")
+            restore_summary = SnapshotService(vector_store_service).restore(settings.snapshot_restore_path, only_if_empty=True)
+            snapshot_restored = not restore_summary["skipped"]
         else:
-            print(f"Encontrados {len(pdf_files_found)} arquivos PDF para processar.")
-            for pdf_path in pdf_files_found:
-                try:
-                    print(f"Processando arquivo: {pdf_path.name}...")
-                    docs = load_and_split_pdf(str(pdf_path))
-                    if docs:
-                        all_documents.extend(docs)
-                        print(f"Processado {pdf_path.name}: {len(docs)} chunks.")
-                    else:
-                        print(f"Nenhum documento extraído de {pdf_path.name}.")
-                except Exception as e_pdf:
-                    print(f"Erro ao processar o arquivo PDF {pdf_path.name}: {e_pdf}")
-
-            if all_documents:
-                print(f"Total de {len(all_documents)} chunks de documentos para gerar embeddings.")
-                all_contents = [doc.page_content for doc in all_documents if hasattr(doc, 'page_content')]
-                
-                if not all_contents or len(all_contents) != len(all_documents):
-                    print("Aviso: Alguns documentos não possuem 'page_content' ou a lista de conteúdos está vazia.")
-                
-                if all_contents:
-                    print("Gerando embeddings para os documentos...")
-                    doc_embeddings = embedding_service.embed_texts(all_contents)
-                    
-                    if doc_embeddings and len(doc_embeddings) == len(all_contents):
-                        
-                        # Filtra documentos que não geraram conteúdo para manter a consistência
-                        valid_documents_for_upsert = [doc for doc in all_documents if hasattr(doc, 'page_content') and doc.page_content]
-
-                        if len(doc_embeddings) == len(valid_documents_for_upsert):
-                            print(f"Inserindo {len(doc_embeddings)} documentos com embeddings no Vector Store...")
-                            vector_store_service.upsert_documents(valid_documents_for_upsert, doc_embeddings)
-                            print(f"Documentos e embeddings inseridos com sucesso.")
-                        else:
-                            print(f"Discrepância entre número de embeddings ({len(doc_embeddings)}) e documentos válidos ({len(valid_documents_for_upsert)}). Inserção abortada.")
-                    else:
-                        print("Falha na geração de embeddings ou contagem de embeddings divergente da contagem de conteúdos.")
-            else:
-                print("Nenhum documento foi carregado para ingestão.")
-        
+            print(f"Aviso: SNAPSHOT_RESTORE_PATH '{settings.snapshot_restore_path}' não encontrado. Seguindo sem snapshot.")
+
+    # --- Lógica de Ingestão de Dados (modos 'memory' e 'local', ou backend NumPy) ---
+    numpy_backend = settings.vector_store_backend == 'numpy'
+    if numpy_backend or settings.qdrant_mode in ('memory', 'local'):
+        # 'memory' começa vazio a cada startup; 'local' e o backend NumPy persistem em disco e só ingerem PDFs ainda não indexados.
+        # Após restaurar um snapshot, só os PDFs que não estavam nele são processados.
+        skip_indexed = numpy_backend or settings.qdrant_mode == 'local' or snapshot_restored
+        startup_mode = 'numpy' if numpy_backend else settings.qdrant_mode
+        print(f"\n--- Iniciando Ingestão no Startup (Modo '{startup_mode}', ignorar já indexados: {skip_indexed}) ---")
+        ingestion_start_time = time.time()
+        run_ingestion(
+            embedding_service=embedding_service,
+            vector_store_service=vector_store_service,
+            skip_indexed_sources=skip_indexed
+        )
         ingestion_end_time = time.time()
-        print(f"--- Ingestão In-Memory concluída em {(ingestion_end_time - ingestion_start_time):.2f}s ---\n")
+        print(f"--- Ingestão no startup concluída em {(ingestion_end_time - ingestion_start_time):.2f}s ---\n")
     else:
         print(f"Modo Qdrant configurado para '{settings.qdrant_mode}'. "
               "Certifique-se de que os dados foram ingeridos previamente ou que o modo de persistência está configurado.")
@@ -126,7 +104,8 @@ try:
     print("Grafo LangGraph criado e injetado no router.")
     
     set_vector_store_service(vector_store_service)
-    print("VectorStoreService injetado no router.")
+    set_async_vector_store_service(async_vector_store_service)
+    print("VectorStoreService e AsyncVectorStoreService injetados no router.")
 
     # --- Criação da Aplicação FastAPI ---
     app = FastAPI(
@@ -147,8 +126,20 @@ try:
     # --- Inclusão dos Routers ---
     print("Registrando rotas...")
     
-    # INCLU
-    print("Rota raiz (/) registrada.")
+    @app.get("/health", tags=["Health"])
+    async def health_check():
+        """Informa se os modelos/conexões carregados em segundo plano já estão prontos."""
+        ready = embedding_service.is_ready and llm_service.is_ready
+        return {
+            "status": "ok" if ready else "warming_up",
+            "embedding_model_ready": embedding_service.is_ready,
+            "llm_ready": llm_service.is_ready,
+        }
+    print("Rota de health check (/health) registrada.")
+
+    @app.on_event("shutdown")
+    async def close_async_vector_store():
+        await async_vector_store_service.close()
     
     # Depois incluir as outras rotas
     app.include_router(auth_router)
@@ -156,7 +147,8 @@ try:
     app.include_router(retriever_router)
     app.include_router(flashcards_router)
     app.include_router(mindmaps_router) 
-    print("Rotas de autenticação, chat, retriever, flashcards e mapas mentais registradas.")
+    app.include_router(snapshots_router)
+    print("Rotas de autenticação, chat, retriever, flashcards, mapas mentais e snapshots registradas.")
 
     # Imprimir todas as rotas registradas para verificação
     print("\n--- Rotas Registradas na Aplicação ---")
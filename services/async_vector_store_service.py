@@ -0,0 +1,278 @@
+import asyncio
+from typing import List, Dict, Any, Optional, AsyncIterator, Sequence
+import numpy as np
+import httpx
+from qdrant_client import AsyncQdrantClient, models
+from langchain_core.documents import Document
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.settings import settings
+from services.vector_store_service import (
+    VectorStoreService,
+    SearchHit,
+    SearchQuery,
+    SEARCH_PAYLOAD_FIELDS,
+    UNCHANGED_CHECK_FIELDS,
+    course_payload_cache,
+)
+
+
+class AsyncVectorStoreService:
+    """
+    Variante assíncrona do VectorStoreService, com a mesma API de
+    busca/scroll/upsert, para uso direto nas rotas `async def`.
+
+    No modo 'url' usa um único AsyncQdrantClient (pool de conexões HTTP
+    compartilhado, limitado por QDRANT_ASYNC_MAX_CONNECTIONS). Nos modos
+    'memory' e 'local' os dados vivem no cliente síncrono do processo, então
+    as chamadas são delegadas a ele em uma thread, sem bloquear o event loop.
+    A criação/configuração da coleção continua a cargo do serviço síncrono.
+    """
+
+    def __init__(self, vector_store_service: VectorStoreService):
+        self.sync = vector_store_service
+        self.collection_name = vector_store_service.collection_name
+        self.client: Optional[AsyncQdrantClient] = None
+        if not vector_store_service.is_local:
+            max_connections = max(1, settings.qdrant_async_max_connections)
+            print(f"Inicializando AsyncQdrantClient para {settings.qdrant_url} (até {max_connections} conexões)")
+            self.client = AsyncQdrantClient(
+                url=settings.qdrant_url,
+                api_key=settings.qdrant_api_key,
+                timeout=20,
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            )
+        else:
+            print(f"AsyncVectorStoreService delegando ao cliente local (modo '{settings.qdrant_mode}') em threads.")
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+
+    async def search(self,
+                     query_vector: List[float],
+                     limit: int = 3,
+                     filter: Optional[models.Filter] = None,
+                     oversampling: Optional[float] = None,
+                     rescore: Optional[bool] = None,
+                     sparse_vector: Optional[Any] = None,
+                     payload_fields: Optional[Sequence[str]] = SEARCH_PAYLOAD_FIELDS,
+                     with_vectors: bool = False) -> List[SearchHit]:
+        """Equivalente assíncrono de `VectorStoreService.search`."""
+        if self.client is None:
+            return await asyncio.to_thread(self.sync.search, query_vector, limit, filter, oversampling, rescore,
+                                           sparse_vector, payload_fields, with_vectors)
+        results = await self.search_batch(
+            [SearchQuery(query_vector=query_vector, limit=limit, filter=filter,
+                         sparse_vector=sparse_vector, payload_fields=payload_fields, with_vectors=with_vectors)],
+            oversampling=oversampling,
+            rescore=rescore
+        )
+        return results[0]
+
+    async def search_batch(self,
+                           queries: List[SearchQuery],
+                           oversampling: Optional[float] = None,
+                           rescore: Optional[bool] = None) -> List[List[SearchHit]]:
+        """Equivalente assíncrono de `VectorStoreService.search_batch` (uma requisição da Query API)."""
+        if self.client is None:
+            return await asyncio.to_thread(self.sync.search_batch, queries, oversampling, rescore)
+        if not queries:
+            return []
+        if any(not q.query_vector for q in queries):
+            print("Erro: search_batch recebeu consulta com vetor de busca vazio.")
+            return [[] for _ in queries]
+
+        search_params = self.sync._build_search_params(oversampling, rescore)
+        if not self.sync.hybrid_enabled:
+            queries = [SearchQuery(q.query_vector, q.limit, q.filter, None, q.payload_fields, q.with_vectors) for q in queries]
+        try:
+            responses = await self.client.query_batch_points(
+                collection_name=self.collection_name,
+                requests=[self.sync._build_query_request(q, search_params) for q in queries]
+            )
+            return [[self.sync._format_hit(hit) for hit in response.points] for response in responses]
+        except Exception as e:
+            print(f"Erro durante a busca vetorial assíncrona: {type(e).__name__} - {e}")
+            return [[] for _ in queries]
+
+    async def iter_course_payloads(self,
+                                   course_id: str,
+                                   page_size: int = 100,
+                                   fields: Optional[List[str]] = None,
+                                   max_items: Optional[int] = None,
+                                   offset: Optional[Any] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Equivalente assíncrono de `VectorStoreService.iter_course_payloads`."""
+        if self.client is None:
+            pages = self.sync.iter_course_payloads(course_id, page_size, fields, max_items, offset)
+            while (page := await asyncio.to_thread(next, pages, None)) is not None:
+                yield page
+            return
+
+        with_payload = self.sync._payload_selector(fields)
+        query_filter = self.sync._course_filter(course_id)
+        current_offset = offset
+        produced = 0
+        while max_items is None or produced < max_items:
+            request_size = page_size if max_items is None else min(page_size, max_items - produced)
+            points, next_page_offset = await self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=query_filter,
+                limit=request_size,
+                offset=current_offset,
+                with_payload=with_payload,
+                with_vectors=False
+            )
+            page = [{"id": point.id, **(point.payload or {})} for point in points]
+            if page:
+                produced += len(page)
+                yield page
+            current_offset = next_page_offset
+            if not points or next_page_offset is None:
+                return
+
+    async def get_all_by_course_id(self, course_id_filter: str, limit: int = 1000, offset: Optional[Any] = None) -> List[Dict[str, Any]]:
+        """Equivalente assíncrono de `VectorStoreService.get_all_by_course_id` (mesmo cache de payloads)."""
+        if self.client is None:
+            return await asyncio.to_thread(self.sync.get_all_by_course_id, course_id_filter, limit, offset)
+        if not course_id_filter:
+            print("Erro: Filtro de ID do curso vazio.")
+            return []
+
+        use_cache = offset is None
+        if use_cache:
+            cached = course_payload_cache.get(self.collection_name, course_id_filter, limit)
+            if cached is not None:
+                print(f"Cache: {len(cached)} documentos do course_id '{course_id_filter}' servidos da memória.")
+                return cached
+            cache_version = course_payload_cache.version(self.collection_name, course_id_filter)
+
+        all_payloads: List[Dict[str, Any]] = []
+        try:
+            async for page in self.iter_course_payloads(course_id_filter, page_size=100, max_items=limit, offset=offset):
+                all_payloads.extend(p for p in page if len(p) > 1)
+            print(f"Busca por scroll (async) para course_id '{course_id_filter}' encontrou {len(all_payloads)} resultados.")
+            if use_cache:
+                course_payload_cache.put(
+                    self.collection_name, course_id_filter, all_payloads,
+                    complete=len(all_payloads) < limit, version=cache_version
+                )
+            return all_payloads
+        except Exception as e:
+            print(f"Erro CRÍTICO durante a busca por scroll assíncrona para course_id '{course_id_filter}': {type(e).__name__} - {e}")
+            return []
+
+    async def upsert_documents(self,
+                               documents: List[Document],
+                               embeddings: np.ndarray | List[List[float]],
+                               id_course: str,
+                               batch_size: int = 100,
+                               skip_unchanged: bool = True,
+                               sparse_embeddings: Optional[List[Any]] = None) -> bool:
+        """
+        Equivalente assíncrono de `VectorStoreService.upsert_documents`: no modo
+        'url' até QDRANT_UPSERT_PARALLELISM lotes ficam em voo ao mesmo tempo.
+        """
+        if self.client is None:
+            return await asyncio.to_thread(self.sync.upsert_documents, documents, embeddings, id_course,
+                                           batch_size, skip_unchanged, sparse_embeddings)
+        parallelism = max(1, settings.qdrant_upsert_parallelism)
+        batch_args = self.sync._plan_upsert_batches(documents, embeddings, id_course, batch_size, skip_unchanged,
+                                                    sparse_embeddings, parallelism)
+        if batch_args is None:
+            return False
+        legacy = self.sync._legacy_points_filter(documents, id_course)
+        if legacy is not None:
+            legacy_filter, legacy_keys = legacy
+            try:
+                await self.client.delete(
+                    collection_name=self.collection_name,
+                    points_selector=models.FilterSelector(filter=legacy_filter),
+                    wait=True
+                )
+                self.sync._legacy_checked.update(legacy_keys)
+            except Exception as e:
+                print(f"Aviso: falha ao remover pontos legados (sem content_hash) do curso {id_course}: {type(e).__name__} - {e}")
+
+        semaphore = asyncio.Semaphore(parallelism)
+
+        async def run_batch(args: tuple) -> Dict[str, Any]:
+            async with semaphore:
+                return await self._upsert_batch(*args)
+
+        reports = await asyncio.gather(*(run_batch(args) for args in batch_args))
+        return self.sync._finish_upsert(list(reports), id_course)
+
+    async def delete_points(self, id_course: str, point_ids: List[str], batch_size: int = 1000) -> bool:
+        """Equivalente assíncrono de `VectorStoreService.delete_points`."""
+        if self.client is None:
+            return await asyncio.to_thread(self.sync.delete_points, id_course, point_ids, batch_size)
+        success = True
+        for start in range(0, len(point_ids), batch_size):
+            try:
+                await self.client.delete(
+                    collection_name=self.collection_name,
+                    points_selector=models.PointIdsList(points=point_ids[start:start + batch_size]),
+                    wait=True
+                )
+            except Exception as e:
+                print(f"Erro ao remover pontos do curso {id_course}: {type(e).__name__} - {e}")
+                success = False
+        course_payload_cache.invalidate(self.collection_name, id_course)
+        return success
+
+    async def _upsert_batch(self,
+                            batch_number: int,
+                            num_batches: int,
+                            batch_docs: List[Document],
+                            batch_vectors: np.ndarray,
+                            id_course: str,
+                            skip_unchanged: bool,
+                            batch_sparse: Optional[List[Any]] = None) -> Dict[str, Any]:
+        report = self.sync._new_batch_report(batch_number, len(batch_docs))
+        ids, payloads = self.sync._prepare_batch_payloads(batch_docs, id_course)
+
+        if skip_unchanged:
+            try:
+                existing = await self.client.retrieve(
+                    collection_name=self.collection_name,
+                    ids=ids,
+                    with_payload=UNCHANGED_CHECK_FIELDS,
+                    with_vectors=False
+                )
+                keep = self.sync._positions_with_new_content(existing, ids, payloads)
+            except Exception as e:
+                print(f"Aviso: não foi possível verificar pontos existentes ({type(e).__name__} - {e}). Reenviando o lote inteiro.")
+                keep = list(range(len(ids)))
+            report["skipped"] = len(ids) - len(keep)
+            if not keep:
+                report["success"] = True
+                return report
+            if report["skipped"]:
+                ids, payloads, batch_vectors, batch_sparse = self.sync._select_positions(keep, ids, payloads, batch_vectors, batch_sparse)
+
+        points = self.sync._build_batch_points(ids, payloads, batch_vectors, batch_sparse)
+        max_attempts = 1 + max(0, settings.qdrant_upsert_max_retries)
+        for attempt in range(1, max_attempts + 1):
+            report["attempts"] = attempt
+            try:
+                operation_info = await self.client.upsert(
+                    collection_name=self.collection_name,
+                    wait=True,
+                    points=points
+                )
+                if operation_info.status == models.UpdateStatus.COMPLETED:
+                    report["upserted"] = len(ids)
+                    report["success"] = True
+                    report["error"] = None
+                    return report
+                report["error"] = f"status {operation_info.status}"
+            except Exception as e:
+                report["error"] = f"{type(e).__name__} - {e}"
+                print(f"Erro durante o upsert assíncrono do Lote {batch_number}/{num_batches}: {report['error']}")
+            if attempt < max_attempts:
+                await asyncio.sleep(settings.qdrant_upsert_retry_backoff_seconds * (2 ** (attempt - 1)))
+
+        print(f"Erro CRÍTICO: Lote {batch_number}/{num_batches} falhou após {max_attempts} tentativas.")
+        return report
@@ -1,34 +1,89 @@
 import os
-from typing import List
+from typing import List, Dict, Any, Tuple, NamedTuple
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 from config.settings import settings
 
-def load_and_split_pdf(file_path:str) -> List[Document]:
-    """Carrega e divide um pdf em chunks."""
+def load_pdf(file_path: str) -> List[Document]:
+    """Carrega as páginas de um pdf (um Document por página)."""
     if not file_path or not os.path.exists(file_path):
         print(f"Erro: Arquivo {file_path} não encontrado.")
         return []
-    
+
     print(f"Carregando arquivo: {file_path}")
+    loader = PyPDFLoader(file_path)
+    docs_loaded = loader.load()
+    if not docs_loaded:
+        print(f"Aviso: Nenhum documento carregado do arquivo {file_path}.")
+    return docs_loaded
+
+def split_documents(docs_loaded: List[Document]) -> List[Document]:
+    """Divide as páginas carregadas em chunks, numerando-os dentro de cada página."""
+    if not docs_loaded:
+        return []
+    text_splitter = RecursiveCharacterTextSplitter(
+        separators=["\n\n", "\n", ". ", " ", ""], # Prioriza separadores maiores
+        chunk_size=settings.chunk_size,
+        chunk_overlap=settings.chunk_overlap,
+        length_function=len,
+        is_separator_regex=False,
+    )
+    split_docs = text_splitter.split_documents(docs_loaded)
+    # Índice do chunk dentro da página: junto com fonte e página identifica o chunk de forma estável
+    chunks_per_page = {}
+    for doc in split_docs:
+        page = doc.metadata.get("page", -1)
+        doc.metadata["chunk_index"] = chunks_per_page.get(page, 0)
+        chunks_per_page[page] = doc.metadata["chunk_index"] + 1
+    print(f"Documento dividido em {len(split_docs)} chunks.")
+    return split_docs
+
+def load_and_split_pdf(file_path:str) -> List[Document]:
+    """Carrega e divide um pdf em chunks."""
     try:
-        loader = PyPDFLoader(file_path)
-        docs_loaded = loader.load()
-        if not docs_loaded:
-            print(f"Aviso: Nenhum documento carregado do arquivo {file_path}.")
-            return []
-        text_splitter = RecursiveCharacterTextSplitter(
-            separators=["\n\n", "\n", ". ", " ", ""], # Prioriza separadores maiores
-            chunk_size=settings.chunk_size,
-            chunk_overlap=settings.chunk_overlap,
-            length_function=len,
-            is_separator_regex=False,
-        )
-        split_docs = text_splitter.split_documents(docs_loaded)
-        print(f"Documento dividido em {len(split_docs)} chunks.")
-        return split_docs
+        return split_documents(load_pdf(file_path))
     except Exception as e:
         print(f"Erro ao carregar ou dividir o PDF '{file_path}': {e}")
         return []
-        
+
+class ParsedPdf(NamedTuple):
+    """
+    Resultado compacto e serializável (pickle barato) de `parse_pdf`: os
+    metadados comuns ao arquivo vão uma vez só, os de cada página só com o
+    que difere, e cada chunk é uma tupla (texto, página, chunk_index).
+    """
+    file_metadata: Dict[str, Any]
+    page_metadata: Dict[int, Dict[str, Any]]
+    chunks: List[Tuple[str, int, int]]
+
+def parse_pdf(file_path: str) -> ParsedPdf:
+    """
+    Carrega e divide um pdf devolvendo um `ParsedPdf` em vez de Documents.
+    Feita para rodar em um ProcessPoolExecutor (a extração do pypdf é
+    Python puro e limitada pela CPU); erros sobem para quem chamou.
+    """
+    pages = load_pdf(file_path)
+    file_metadata = {k: v for k, v in pages[0].metadata.items() if k not in ("page", "page_label")} if pages else {}
+    page_metadata = {}
+    for page in pages:
+        page_number = page.metadata.get("page", -1)
+        page_metadata[page_number] = {
+            k: v for k, v in page.metadata.items()
+            if k != "page" and (k not in file_metadata or file_metadata[k] != v)
+        }
+    chunks = [
+        (doc.page_content, doc.metadata.get("page", -1), doc.metadata["chunk_index"])
+        for doc in split_documents(pages)
+    ]
+    return ParsedPdf(file_metadata, page_metadata, chunks)
+
+def parsed_to_documents(parsed: ParsedPdf) -> List[Document]:
+    """Reconstrói os Documents (mesmos metadados de `split_documents`) a partir de um `ParsedPdf`."""
+    return [
+        Document(
+            page_content=text,
+            metadata={**parsed.file_metadata, **parsed.page_metadata.get(page, {}), "page": page, "chunk_index": chunk_index}
+        )
+        for text, page, chunk_index in parsed.chunks
+    ]
@@ -1,22 +1,381 @@
-from typing import List
-from fastembed import TextEmbedding
+import os
+import time
+import queue
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Optional, Dict, Any, Callable, Iterable
+import numpy as np
+from fastembed import TextEmbedding, SparseTextEmbedding
+from fastembed.sparse.sparse_embedding_base import SparseEmbedding
 from langchain_core.documents import Document
-from config.settings import settings 
+from config.settings import settings
+
+
+class EmbeddingCache:
+    """
+    Cache persistente (SQLite) de embeddings de documentos, endereçado por
+    nome do modelo + hash SHA-256 do texto. Mantém no máximo `max_entries`
+    vetores, removendo os acessados há mais tempo (LRU).
+    """
+    _LOOKUP_CHUNK = 500  # Limite seguro de parâmetros por consulta no SQLite
+
+    def __init__(self, cache_dir: str, model_name: str, max_entries: int):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, "embedding_vectors.sqlite3")
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+        print(f"Cache de embeddings em disco: {self.db_path} (máx. {self.max_entries} vetores)")
+
+    @staticmethod
+    def _hash_text(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Retorna o vetor em cache para cada texto (ou None quando ausente)."""
+        hashes = [self._hash_text(t) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        now = time.time()
+        with self._lock:
+            unique_hashes = list(dict.fromkeys(hashes))
+            for start in range(0, len(unique_hashes), self._LOOKUP_CHUNK):
+                chunk = unique_hashes[start:start + self._LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    (self.model_name, *chunk)
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                    [(now, self.model_name, h) for h in found]
+                )
+                self._conn.commit()
+            results = [found.get(h) for h in hashes]
+            hits = sum(1 for r in results if r is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+
+    def put_many(self, texts: List[str], vectors: List[np.ndarray]):
+        """Grava os vetores no cache e aplica o limite de tamanho."""
+        if not texts:
+            return
+        now = time.time()
+        rows = [
+            (self.model_name, self._hash_text(t), np.asarray(v, dtype=np.float32).tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_access) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self):
+        total = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = total - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN ("
+                " SELECT rowid FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (excess,)
+            )
+            print(f"Cache de embeddings: {excess} vetores antigos removidos (limite {self.max_entries}).")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "entries": entries,
+                "max_entries": self.max_entries,
+            }
+
+
+class QueryEmbeddingCache:
+    """
+    Cache em memória, thread-safe, de embeddings de consultas (LRU + TTL).
+    A chave é (modelo, texto normalizado), então perguntas repetidas não
+    passam de novo pelo modelo ONNX.
+    """
+    def __init__(self, model_name: str, max_entries: int, ttl_seconds: float):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Normaliza Unicode (NFC) e espaços em branco da consulta."""
+        return " ".join(unicodedata.normalize("NFC", text).split())
+
+    def _key(self, text: str) -> tuple:
+        return (self.model_name, self.normalize(text))
+
+    def get(self, text: str) -> Optional[List[float]]:
+        key = self._key(text)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(entry[1])
+            if entry is not None:
+                del self._entries[key]  # Expirado
+            self.misses += 1
+            return None
+
+    def put(self, text: str, vector: List[float]):
+        key = self._key(text)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), tuple(vector))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+class QueryEmbeddingBatcher:
+    """
+    Agrupa consultas concorrentes em uma única chamada ao modelo.
+    Uma thread dedicada junta os textos que chegam dentro de `window_ms`
+    (ou até `max_batch_size`), executa um único `embed` e resolve o
+    Future de cada chamador.
+    """
+    def __init__(self, embed_fn: Callable[[List[str]], Iterable[np.ndarray]], max_batch_size: int, window_ms: float):
+        self._embed_fn = embed_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.window_seconds = max(0.0, window_ms) / 1000.0
+        self.batches = 0
+        self.items = 0
+        self._stats_lock = threading.Lock()
+        self._queue: "queue.Queue[tuple[str, Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="query-embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        """Enfileira um texto e retorna um Future com o vetor (np.ndarray)."""
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _collect_batch(self) -> List[tuple]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            # Textos idênticos no mesmo lote são calculados uma única vez
+            waiters: Dict[str, List[Future]] = {}
+            for text, future in batch:
+                if future.set_running_or_notify_cancel():
+                    waiters.setdefault(text, []).append(future)
+            if not waiters:
+                continue
+            texts = list(waiters.keys())
+            try:
+                vectors = list(self._embed_fn(texts))
+                for text, vector in zip(texts, vectors):
+                    for future in waiters[text]:
+                        future.set_result(vector)
+                if len(vectors) != len(texts):
+                    # Sem isso os chamadores dos textos sem vetor esperariam para sempre
+                    error = RuntimeError(f"O modelo retornou {len(vectors)} vetores para {len(texts)} consultas.")
+                    for text in texts[len(vectors):]:
+                        for future in waiters[text]:
+                            future.set_exception(error)
+            except Exception as e:
+                for futures in waiters.values():
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+            with self._stats_lock:
+                self.batches += 1
+                self.items += len(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": (self.items / self.batches) if self.batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "window_ms": self.window_seconds * 1000.0,
+            }
+
 
 class EmbeddingService:
-    def __init__(self):
-        print(f"Inicializando embeddings com {settings.embedding_model_name}")
+    def __init__(self,
+                 model_name: Optional[str] = None,
+                 threads: Optional[int] = None,
+                 enable_caches: bool = True,
+                 enable_query_batching: Optional[bool] = None):
+        """
+        Por padrão usa as configurações do .env; os parâmetros permitem
+        sobrescrever modelo/threads e desligar os caches e o micro-batching
+        de consultas (ex.: benchmarks).
+        """
+        self.model_name = model_name or settings.embedding_model_name
+        self.threads = threads if threads is not None else settings.embedding_threads
+        print(f"Inicializando embeddings com {self.model_name}")
+        self.model: Optional[TextEmbedding] = None
+        self.sparse_model: Optional[SparseTextEmbedding] = None
+        self._ready = threading.Event()
+        self._load_error: Optional[Exception] = None
+        self._sparse_load_error: Optional[Exception] = None
+
+        dimension = self._dimension_from_metadata(self.model_name)
+        if dimension is not None:
+            self.dimension = dimension
+            print(f"Dimensão do embedding (metadados do modelo): {self.dimension}")
+
+        if dimension is not None and settings.background_warmup:
+            # Carrega e aquece o modelo em segundo plano; as chamadas de embedding aguardam a prontidão
+            threading.Thread(target=self._load_model, name="embedding-warmup", daemon=True).start()
+        else:
+            self._load_model()
+            if self._load_error is not None:
+                raise RuntimeError(f"Erro ao inicializar o modelo de embeddings: F{self._load_error}")
+            if dimension is None:
+                self._determine_dimension()
+
+        self.vector_cache: Optional[EmbeddingCache] = None
+        if enable_caches and settings.embedding_vector_cache_enabled:
+            try:
+                self.vector_cache = EmbeddingCache(
+                    cache_dir=settings.embedding_cache_dir,
+                    model_name=self.model_name,
+                    max_entries=settings.embedding_vector_cache_max_entries
+                )
+            except Exception as e:
+                print(f"Aviso: cache de embeddings em disco desativado ({type(e).__name__} - {e}).")
+        self.query_cache: Optional[QueryEmbeddingCache] = None
+        if enable_caches and settings.query_embedding_cache_enabled:
+            self.query_cache = QueryEmbeddingCache(
+                model_name=self.model_name,
+                max_entries=settings.query_embedding_cache_max_entries,
+                ttl_seconds=settings.query_embedding_cache_ttl_seconds
+            )
+        self.query_batcher: Optional[QueryEmbeddingBatcher] = None
+        if enable_query_batching is None:
+            enable_query_batching = settings.query_batching_enabled
+        if enable_query_batching:
+            self.query_batcher = QueryEmbeddingBatcher(
+                embed_fn=lambda texts: self._get_model().embed(texts),
+                max_batch_size=settings.query_batching_max_batch_size,
+                window_ms=settings.query_batching_window_ms
+            )
+
+    @staticmethod
+    def _dimension_from_metadata(model_name: str) -> Optional[int]:
+        """Lê a dimensão do vetor a partir da lista de modelos suportados pelo fastembed, sem carregar o modelo."""
+        try:
+            for description in TextEmbedding.list_supported_models():
+                if description.get("model", "").lower() == model_name.lower():
+                    return int(description["dim"])
+        except Exception as e:
+            print(f"Aviso: não foi possível ler os metadados do modelo '{model_name}': {e}")
+        return None
+
+    def _load_model(self):
+        """Carrega o modelo e executa uma inferência de aquecimento; sinaliza a prontidão ao final."""
+        start_time = time.time()
         try:
-            self.model = TextEmbedding(settings.embedding_model_name, cache_dir=settings.embedding_cache_dir)
-            self._determine_dimension()
+            model = TextEmbedding(self.model_name, cache_dir=settings.embedding_cache_dir, threads=self.threads)
+            list(model.embed(["aquecimento do modelo"]))
+            self.model = model
+            print(f"Modelo de embeddings carregado e aquecido em {time.time() - start_time:.2f}s.")
         except Exception as e:
             print(f"Erro ao inicializar o modelo de embeddings: {e}")
-            raise RuntimeError(f"Erro ao inicializar o modelo de embeddings: F{e}")
-    
+            self._load_error = e
+        # O modelo esparso é carregado à parte: uma falha nele não pode desativar os embeddings densos
+        if self._load_error is None and settings.hybrid_search_enabled:
+            try:
+                self.sparse_model = SparseTextEmbedding(
+                    settings.sparse_model_name,
+                    cache_dir=settings.embedding_cache_dir,
+                    language=settings.sparse_model_language
+                )
+            except Exception as e:
+                print(f"ERRO: falha ao carregar o modelo esparso '{settings.sparse_model_name}' com a busca híbrida ativa; "
+                      f"consultas usarão apenas a busca densa e a ingestão será recusada ({type(e).__name__} - {e}).")
+                self._sparse_load_error = e
+        self._ready.set()
+
+    @property
+    def is_ready(self) -> bool:
+        """Indica se o modelo já foi carregado e aquecido com sucesso."""
+        return self._ready.is_set() and self._load_error is None
+
+    def _get_model(self) -> TextEmbedding:
+        """Retorna o modelo, aguardando o carregamento em segundo plano se necessário."""
+        if not self._ready.wait(timeout=settings.embedding_warmup_timeout_seconds):
+            raise RuntimeError("Modelo de embeddings ainda não está pronto (tempo de espera esgotado).")
+        if self._load_error is not None:
+            raise RuntimeError(f"Falha ao carregar o modelo de embeddings: {self._load_error}")
+        return self.model
+
+    def _get_sparse_model(self) -> Optional[SparseTextEmbedding]:
+        """Retorna o modelo esparso (BM25) ou None se a busca híbrida estiver desativada."""
+        if not settings.hybrid_search_enabled:
+            return None
+        self._get_model()  # Aguarda o carregamento em segundo plano
+        return self.sparse_model
+
     def _determine_dimension(self):
         """Tenta determinar a dimensão do vetor de embedding."""
         try:
-            teste_embedding = list(self.model.embed(['test']))[0]
+            teste_embedding = list(self._get_model().embed(['test']))[0]
             self.dimension = len(teste_embedding)
             print(f"Dimensão do embedding: {self.dimension}")
         except Exception as e:
@@ -29,26 +388,117 @@ class EmbeddingService:
             raise RuntimeError("Dimensão do embedding não foi determinada.")
         return self.dimension
 
-    def embed_texts(self, texts: List[str] | List[Document]) -> List[List[float]]:
-        """Gera embeddings para uma lista de textos ou documentos."""
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Retorna contadores de acerto/erro dos caches de documentos (disco) e de consultas (memória)."""
+        return {
+            "documents": self.vector_cache.stats() if self.vector_cache else {"enabled": False},
+            "queries": self.query_cache.stats() if self.query_cache else {"enabled": False},
+            "query_batching": self.query_batcher.stats() if self.query_batcher else {"enabled": False},
+        }
+
+    def embed_texts(self, texts: List[str] | List[Document], batch_size: Optional[int] = None) -> np.ndarray:
+        """
+        Gera embeddings para uma lista de textos ou documentos e retorna uma
+        matriz float32 contígua (n, dim). Textos já presentes no cache em
+        disco não são recalculados. `batch_size` sobrescreve EMBEDDING_BATCH_SIZE.
+        """
         if not texts:
-            return []
-        print(f"Gerando embeddings para {len(texts)} itens...")
+            return np.empty((0, self.get_embedding_dimension()), dtype=np.float32)
+        contents = [t.page_content if isinstance(t, Document) else t for t in texts]
+        print(f"Gerando embeddings para {len(contents)} itens...")
         try:
-            embeddings_generator = self.model.embed(texts)
-            embeddings_list = [emb.tolist() for emb in embeddings_generator]
-            print("Embeddings gerados.")
-            return embeddings_list
+            matrix = np.empty((len(contents), self.get_embedding_dimension()), dtype=np.float32)
+            cached: List[Optional[np.ndarray]] = [None] * len(contents)
+            if self.vector_cache is not None:
+                # Falha de leitura do cache não impede a indexação: conta tudo como ausente
+                try:
+                    cached = self.vector_cache.get_many(contents)
+                except Exception as e:
+                    print(f"Aviso: falha ao ler o cache de embeddings; recalculando os {len(contents)} itens ({type(e).__name__} - {e}).")
+
+            # Agrupa os textos ausentes do cache para calcular cada um apenas uma vez
+            missing: Dict[str, List[int]] = {}
+            for i, vector in enumerate(cached):
+                if vector is None:
+                    missing.setdefault(contents[i], []).append(i)
+                else:
+                    matrix[i] = vector
+
+            if missing:
+                # Ordena por tamanho para que cada lote agrupe textos de comprimento
+                # parecido (menos tokens de padding); a ordem original é restaurada
+                # pelo mapeamento texto -> índices em `missing`.
+                missing_texts = sorted(missing.keys(), key=len)
+                new_embeddings = list(self._get_model().embed(
+                    missing_texts,
+                    batch_size=batch_size or settings.embedding_batch_size,
+                    parallel=settings.embedding_parallel
+                ))
+                for text, emb in zip(missing_texts, new_embeddings):
+                    matrix[missing[text]] = emb
+                if self.vector_cache is not None:
+                    # Os vetores já estão na matriz: uma falha ao gravar no cache só perde o reaproveitamento
+                    try:
+                        self.vector_cache.put_many(missing_texts, new_embeddings)
+                    except Exception as e:
+                        print(f"Aviso: falha ao gravar no cache de embeddings; gravação ignorada ({type(e).__name__} - {e}).")
+
+            computed = sum(len(indices) for indices in missing.values())
+            print(f"Embeddings gerados ({len(missing)} calculados, {len(contents) - computed} do cache).")
+            return matrix
         except Exception as e:
             print(f"Erro ao gerar embeddings: {e}")
-            return []
+            return np.empty((0, self.get_embedding_dimension()), dtype=np.float32)
+
     def embed_single_text(self, text:str) -> List[float] | None:
-        """Gera um embedding para um único texto."""
+        """Gera um embedding para um único texto, reaproveitando o cache de consultas."""
         if not text:
             return None
+        if self.query_cache is not None:
+            cached = self.query_cache.get(text)
+            if cached is not None:
+                return cached
         try:
-            embedding = list(self.model.embed([text]))[0]
-            return embedding.tolist()
+            if self.query_batcher is not None:
+                timeout = settings.query_batching_timeout_seconds
+                if not self._ready.is_set():
+                    timeout += settings.embedding_warmup_timeout_seconds
+                embedding = self.query_batcher.submit(text).result(timeout=timeout).tolist()
+            else:
+                embedding = list(self._get_model().embed([text]))[0].tolist()
+            if self.query_cache is not None:
+                self.query_cache.put(text, embedding)
+            return embedding
         except Exception as e:
             print(f"Erro ao gerar embedding: {e}")
             return None
+
+    def embed_sparse_texts(self, texts: List[str]) -> Optional[List[SparseEmbedding]]:
+        """
+        Gera vetores esparsos (BM25) dos documentos; None se a busca híbrida
+        estiver desativada ou em caso de falha (quem indexa deve tratar o None
+        com a busca híbrida ativa como erro).
+        """
+        sparse_model = self._get_sparse_model()
+        if not texts:
+            return None
+        if sparse_model is None:
+            if settings.hybrid_search_enabled:
+                print(f"ERRO: busca híbrida ativa, mas o modelo esparso não está disponível ({self._sparse_load_error}).")
+            return None
+        try:
+            return list(sparse_model.embed(texts, batch_size=settings.embedding_batch_size))
+        except Exception as e:
+            print(f"Erro ao gerar embeddings esparsos: {e}")
+            return None
+
+    def embed_sparse_query(self, text: str) -> Optional[SparseEmbedding]:
+        """Gera o vetor esparso (BM25) de uma consulta; None se a busca híbrida estiver desativada."""
+        sparse_model = self._get_sparse_model()
+        if sparse_model is None or not text:
+            return None
+        try:
+            return list(sparse_model.query_embed(text))[0]
+        except Exception as e:
+            print(f"Erro ao gerar embedding esparso da consulta: {e}")
+            return None
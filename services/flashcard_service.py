@@ -6,13 +6,12 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.settings import settings
-from services.vector_store_service import VectorStoreService
 
 load_dotenv()
 class FlashcardService:
 
-    def __init__(self, vector_size=1536, api_key: Optional[str] = None):
-        self.vector_store = VectorStoreService(vector_size)
+    def __init__(self, vector_store_service, api_key: Optional[str] = None):
+        self.vector_store = vector_store_service
         self.client = Groq(api_key=api_key) if api_key else None
         
     def get_course_content(self, id_course: str) -> List[Dict[str, Any]]:
@@ -136,7 +135,11 @@ if __name__ == "__main__":
     if not api_key:
         print("AVISO: GROQ_API_KEY não encontrada no ambiente.")
     
-    flashcard_service = FlashcardService(vector_size=1536, api_key=api_key)
+    # Execução avulsa: cria um vector store próprio com a dimensão do modelo de embeddings
+    from services.embedding_service import EmbeddingService
+    from services.vector_store_service import create_vector_store_service
+    vector_store_service = create_vector_store_service(EmbeddingService().get_embedding_dimension())
+    flashcard_service = FlashcardService(vector_store_service=vector_store_service, api_key=api_key)
     course_id = "4629"
     
     try:
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.settings import settings
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ingestion_fingerprint(collection_name: str) -> Dict[str, Any]:
+    """Configurações que, se mudarem, invalidam todos os pontos já produzidos."""
+    return {
+        "collection": collection_name,
+        "backend": settings.vector_store_backend,
+        "chunk_size": settings.chunk_size,
+        "chunk_overlap": settings.chunk_overlap,
+        "embedding_model": settings.embedding_model_name,
+    }
+
+
+@dataclass
+class IngestionPlan:
+    """Resultado da comparação entre os PDFs da pasta e o manifesto do curso."""
+    unchanged: List[Path] = field(default_factory=list)
+    changed: List[Path] = field(default_factory=list)
+    new: List[Path] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    # Hash/tamanho/mtime já calculados na comparação, reaproveitados ao registrar
+    stats: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    @property
+    def pending(self) -> List[Path]:
+        return self.changed + self.new
+
+
+class IngestionManifest:
+    """
+    Manifesto JSON da ingestão de uma pasta de curso: para cada PDF guarda
+    hash, tamanho, mtime e os IDs dos pontos produzidos, além das
+    configurações de chunking/modelo usadas. Permite que a reingestão pule
+    PDFs inalterados, substitua os pontos de PDFs alterados e remova do
+    índice os PDFs que saíram da pasta.
+    """
+
+    def __init__(self, course_id: str, collection_name: str, manifest_dir: Optional[str] = None):
+        self.course_id = course_id
+        self.collection_name = collection_name
+        self.path = os.path.join(manifest_dir or self.default_dir(), f"{collection_name}-{course_id}.json")
+        self.fingerprint = ingestion_fingerprint(collection_name)
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    @staticmethod
+    def default_dir() -> str:
+        return settings.ingestion_manifest_dir or os.path.join(settings.embedding_cache_dir, "ingest_manifests")
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"Aviso: manifesto de ingestão '{self.path}' ilegível ({type(e).__name__} - {e}). Reprocessando o curso.")
+            return
+        if data.get("version") != MANIFEST_VERSION:
+            print(f"Aviso: manifesto '{self.path}' com versão {data.get('version')} não suportada. Reprocessando o curso.")
+            return
+        self.files = data.get("files", {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "course_id": self.course_id,
+                "updated_at": time.time(),
+                "files": self.files,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    @classmethod
+    def tracked_course_ids(cls, collection_name: str, manifest_dir: Optional[str] = None) -> List[str]:
+        """IDs dos cursos que possuem manifesto para a coleção."""
+        directory = manifest_dir or cls.default_dir()
+        if not os.path.isdir(directory):
+            return []
+        prefix = f"{collection_name}-"
+        return sorted(
+            name[len(prefix):-len(".json")] for name in os.listdir(directory)
+            if name.startswith(prefix) and name.endswith(".json")
+        )
+
+    def delete(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def plan(self, pdf_files: List[Path]) -> IngestionPlan:
+        """
+        Classifica os PDFs em inalterados, alterados e novos, e lista os que
+        saíram da pasta. Tamanho + mtime iguais dispensam o cálculo do hash.
+        """
+        plan = IngestionPlan()
+        present = set()
+        for pdf_path in pdf_files:
+            name = pdf_path.name
+            present.add(name)
+            stat = pdf_path.stat()
+            entry = self.files.get(name)
+            if entry is None:
+                plan.new.append(pdf_path)
+                continue
+            if entry.get("fingerprint") != self.fingerprint:
+                # Chunking/modelo diferentes: reprocessa; os IDs antigos do registro são removidos depois
+                plan.changed.append(pdf_path)
+                continue
+            if entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+                plan.unchanged.append(pdf_path)
+                continue
+            sha256 = file_sha256(pdf_path)
+            plan.stats[name] = {"sha256": sha256, "size": stat.st_size, "mtime": stat.st_mtime}
+            if entry.get("sha256") == sha256:
+                # Só o mtime mudou (ex.: cópia/touch): atualiza o registro sem reprocessar
+                entry.update(plan.stats[name])
+                plan.unchanged.append(pdf_path)
+            else:
+                plan.changed.append(pdf_path)
+        plan.removed = [name for name in self.files if name not in present]
+        return plan
+
+    def point_ids(self, file_name: str) -> List[str]:
+        return list(self.files.get(file_name, {}).get("point_ids", []))
+
+    def record(self, pdf_path: Path, point_ids: List[str], known_stats: Optional[Dict[str, Any]] = None):
+        stats = known_stats
+        if stats is None:
+            stat = pdf_path.stat()
+            stats = {"sha256": file_sha256(pdf_path), "size": stat.st_size, "mtime": stat.st_mtime}
+        self.files[pdf_path.name] = {
+            **stats,
+            "fingerprint": self.fingerprint,
+            "point_ids": point_ids,
+            "chunks": len(point_ids),
+            "indexed_at": time.time(),
+        }
+
+    def forget(self, file_name: str):
+        self.files.pop(file_name, None)
@@ -0,0 +1,158 @@
+import time
+import queue
+import threading
+import traceback
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Callable, Iterable, Iterator
+import numpy as np
+from langchain_core.documents import Document
+
+
+@dataclass
+class PdfTask:
+    """Unidade de trabalho do pipeline: um PDF de um curso, preenchido estágio a estágio."""
+    course_id: str
+    pdf_path: Path
+    pages: Optional[List[Document]] = None
+    documents: Optional[List[Document]] = None
+    embeddings: Optional[np.ndarray] = None
+    sparse_embeddings: Optional[List[Any]] = None
+    # IDs registrados no manifesto antes desta ingestão e os produzidos por ela
+    previous_point_ids: List[str] = field(default_factory=list)
+    point_ids: Optional[List[str]] = None
+    success: bool = False
+    error: Optional[str] = None
+    stage_seconds: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class PipelineStage:
+    """
+    Estágio do pipeline: `fn` processa a tarefa no lugar (exceções marcam a
+    tarefa como falha). Com `group_target` > 0 o worker junta tarefas até
+    somar `group_target` itens (medidos por `group_size`) ou o fluxo acabar,
+    e `fn` recebe a lista; uma exceção marca todas as tarefas do grupo.
+    """
+    name: str
+    fn: Callable[[Any], None]
+    workers: int = 1
+    group_target: int = 0
+    group_size: Optional[Callable[[PdfTask], int]] = None
+
+
+_STOP = object()
+
+
+class StagedPipeline:
+    """
+    Pipeline de estágios (ex.: load -> split -> embed -> upsert) ligados por
+    filas limitadas, cada um com seu próprio número de threads. Enquanto um
+    PDF é enviado ao Qdrant, os seguintes já estão sendo lidos e embedados,
+    então a vazão fica próxima à do estágio mais lento; as filas limitadas
+    seguram os estágios rápidos e mantêm a memória sob controle.
+
+    Tarefas com falha seguem adiante sem passar pelos estágios seguintes e
+    são entregues com `error` preenchido.
+    """
+
+    def __init__(self, stages: List[PipelineStage], queue_size: int = 4):
+        if not stages:
+            raise ValueError("O pipeline precisa de pelo menos um estágio.")
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.busy_seconds: Dict[str, float] = {stage.name: 0.0 for stage in stages}
+        self._lock = threading.Lock()
+
+    def run(self, tasks: Iterable[PdfTask]) -> Iterator[PdfTask]:
+        """Processa as tarefas e as produz conforme terminam (ordem de conclusão)."""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        done_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        remaining = [max(1, stage.workers) for stage in self.stages]
+
+        def feed():
+            for task in tasks:
+                queues[0].put(task)
+            for _ in range(remaining[0]):
+                queues[0].put(_STOP)
+
+        def stop_worker(index: int, output: queue.Queue, is_last: bool):
+            with self._lock:
+                remaining[index] -= 1
+                last_worker = remaining[index] == 0
+            if last_worker:
+                # Só depois que todos os workers do estágio terminaram o próximo é encerrado
+                for _ in range(1 if is_last else remaining[index + 1]):
+                    output.put(_STOP)
+
+        def work(index: int):
+            stage = self.stages[index]
+            is_last = index == len(self.stages) - 1
+            output = done_queue if is_last else queues[index + 1]
+            while True:
+                task = queues[index].get()
+                if task is _STOP:
+                    stop_worker(index, output, is_last)
+                    return
+                group = [task]
+                stopped = False
+                if stage.group_target > 0:
+                    size = lambda t: stage.group_size(t) if t.error is None else 0
+                    total = size(task)
+                    # Tirar da fila libera espaço para o estágio anterior seguir produzindo
+                    while total < stage.group_target:
+                        next_task = queues[index].get()
+                        if next_task is _STOP:
+                            stopped = True
+                            break
+                        group.append(next_task)
+                        total += size(next_task)
+                self._run_stage(stage, [t for t in group if t.error is None])
+                for item in group:
+                    output.put(item)
+                if stopped:
+                    stop_worker(index, output, is_last)
+                    return
+
+        threads = [threading.Thread(target=feed, name="ingest-feed", daemon=True)]
+        for index, stage in enumerate(self.stages):
+            threads.extend(
+                threading.Thread(target=work, args=(index,), name=f"ingest-{stage.name}-{n}", daemon=True)
+                for n in range(remaining[index])
+            )
+        for thread in threads:
+            thread.start()
+
+        while True:
+            task = done_queue.get()
+            if task is _STOP:
+                break
+            yield task
+        for thread in threads:
+            thread.join()
+
+    def _run_stage(self, stage: PipelineStage, tasks: List[PdfTask]):
+        if not tasks:
+            return
+        start = time.perf_counter()
+        try:
+            stage.fn(tasks if stage.group_target > 0 else tasks[0])
+        except Exception as e:
+            error = f"{stage.name}: {type(e).__name__} - {e}"
+            for task in tasks:
+                task.error = error
+            names = ", ".join(task.pdf_path.name for task in tasks)
+            print(f"Erro no estágio '{stage.name}' para {names}: {error}")
+            traceback.print_exc()
+        elapsed = time.perf_counter() - start
+        # Tempo de um grupo repartido entre as tarefas pelo seu tamanho
+        sizes = [max(1, stage.group_size(task)) if stage.group_size else 1 for task in tasks]
+        for task, size in zip(tasks, sizes):
+            task.stage_seconds[stage.name] = elapsed * size / sum(sizes)
+        with self._lock:
+            self.busy_seconds[stage.name] += elapsed
+
+    def report(self) -> str:
+        """Tempo ocupado por estágio (somado entre workers): o maior indica o gargalo."""
+        parts = [f"{stage.name}={self.busy_seconds[stage.name]:.2f}s x{max(1, stage.workers)}" for stage in self.stages]
+        return ", ".join(parts)
@@ -1,3 +1,5 @@
+import threading
+from typing import Optional
 from groq import Groq, APIError
 from config.settings import settings
 
@@ -6,16 +8,39 @@ class LLMService:
         print(f"Inicializando LLmService com Groq em {settings.llm_model_name}")
         if not settings.groq_api_key:
             raise ValueError("API key do Groq não configurada. Configure a variável de ambiente GROQ_API_KEY.")
+        self._ready = threading.Event()
+        self._connection_error: Optional[Exception] = None
         try:
             self.client = Groq(api_key=settings.groq_api_key)
+        except Exception as e:
+            print(f"Erro ao conectar ao Groq: {e}")
+            raise RuntimeError(f"Erro ao conectar ao Groq: {e}")
+        if settings.background_warmup:
+            # A verificação de conexão (chamada de rede) não bloqueia o startup
+            threading.Thread(target=self._check_connection, name="groq-connection-check", daemon=True).start()
+        else:
+            self._check_connection()
+            if self._connection_error is not None:
+                raise RuntimeError(f"Erro ao conectar ao Groq: {self._connection_error}")
+
+    def _check_connection(self):
+        """Valida a API key listando os modelos disponíveis no Groq."""
+        try:
             self.client.models.list()
             print("Conexão com o Groq estabelecida com sucesso.")
         except APIError as e:
             print(f"Erro de API ao conectar ao Groq: {e}")
-            raise RuntimeError(f"Erro ao conectar ao Groq: {e}")
+            self._connection_error = e
         except Exception as e:
             print(f"Erro ao conectar ao Groq: {e}")
-            raise RuntimeError(f"Erro ao conectar ao Groq: {e}")
+            self._connection_error = e
+        finally:
+            self._ready.set()
+
+    @property
+    def is_ready(self) -> bool:
+        """Indica se a verificação de conexão com o Groq já terminou com sucesso."""
+        return self._ready.is_set() and self._connection_error is None
     
     def generate_response(self, prompt:str) -> str | None:
         """Gerar uma resposta usando o modelo LLM baseado no prompt."""
@@ -0,0 +1,316 @@
+from typing import List, Dict, Any, Optional, Iterator, Sequence
+import numpy as np
+from qdrant_client import models
+from langchain_core.documents import Document
+import sys
+import os
+import json
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.settings import settings
+from services.vector_store_service import (
+    VectorStoreService,
+    SearchHit,
+    SearchQuery,
+    SEARCH_PAYLOAD_FIELDS,
+    is_unchanged_payload,
+)
+
+
+class _CourseIndex:
+    """
+    Vetores (normalizados, float32, contíguos) e payloads de um curso.
+    Imutável depois de publicado: cada escrita monta um novo índice e o troca
+    atomicamente, então buscas concorrentes nunca veem um estado parcial.
+    """
+    __slots__ = ("ids", "payloads", "vectors", "row_by_id")
+
+    def __init__(self, ids: List[str], payloads: List[Dict[str, Any]], vectors: np.ndarray):
+        self.ids = ids
+        self.payloads = payloads
+        self.vectors = vectors
+        self.row_by_id = {point_id: row for row, point_id in enumerate(ids)}
+
+
+class NumpyVectorStoreService:
+    """
+    Backend exato e em processo com a mesma interface do VectorStoreService.
+
+    Cada curso tem uma matriz float32 (n, dim) de vetores normalizados,
+    persistida como `.npy` e aberta via memory-map, ao lado de um JSON com IDs
+    e payloads. A busca por curso é um único produto matriz-vetor seguido de
+    `argpartition` para o top-k: exata, sem processo externo e sem o overhead
+    do cliente/filtros do Qdrant. Indicado para cursos com alguns milhares de
+    chunks. Não suporta busca híbrida (vetores esparsos são ignorados).
+
+    Filtros aceitos: `models.Filter` apenas com condições `must` do tipo
+    `FieldCondition` + `MatchValue` (ex.: course_id, source).
+    """
+
+    def __init__(self, vector_size: int, store_path: Optional[str] = None):
+        self.collection_name = settings.qdrant_collection_name
+        self.vector_size = vector_size
+        self.last_upsert_report: List[Dict[str, Any]] = []
+        self.sparse_vector_name = settings.sparse_vector_name
+        self.hybrid_enabled = False
+        self.is_local = True
+        self.store_path = os.path.join(store_path or settings.numpy_store_path, self.collection_name)
+        self._courses: Dict[str, _CourseIndex] = {}
+        self._write_lock = threading.Lock()
+        print(f"Inicializando NumpyVectorStoreService (busca exata em processo) em: {self.store_path}")
+        if settings.hybrid_search_enabled:
+            print("Aviso: o backend NumPy não suporta busca híbrida; usando apenas vetores densos.")
+        os.makedirs(self.store_path, exist_ok=True)
+        self._load_courses()
+
+    # --- Persistência ---
+
+    def _course_dir(self, course_id: str) -> str:
+        return os.path.join(self.store_path, str(course_id))
+
+    def _load_courses(self):
+        for course_id in sorted(os.listdir(self.store_path)):
+            course_dir = self._course_dir(course_id)
+            vectors_path = os.path.join(course_dir, "vectors.npy")
+            points_path = os.path.join(course_dir, "points.json")
+            if not (os.path.isfile(vectors_path) and os.path.isfile(points_path)):
+                continue
+            try:
+                vectors = np.load(vectors_path, mmap_mode="r")
+                with open(points_path, "r", encoding="utf-8") as f:
+                    points = json.load(f)
+                if vectors.shape != (len(points["ids"]), self.vector_size):
+                    print(f"Aviso: índice NumPy do curso '{course_id}' com formato {vectors.shape} inconsistente. Ignorando.")
+                    continue
+                self._courses[course_id] = _CourseIndex(points["ids"], points["payloads"], vectors)
+            except Exception as e:
+                print(f"Aviso: falha ao carregar o índice NumPy do curso '{course_id}': {type(e).__name__} - {e}")
+        total = sum(len(index.ids) for index in self._courses.values())
+        print(f"Backend NumPy: {len(self._courses)} cursos e {total} pontos carregados de {self.store_path}.")
+
+    def _persist(self, course_id: str, index: _CourseIndex) -> _CourseIndex:
+        """Grava o índice do curso (arquivos temporários + rename) e o reabre via memory-map."""
+        course_dir = self._course_dir(course_id)
+        os.makedirs(course_dir, exist_ok=True)
+        vectors_path = os.path.join(course_dir, "vectors.npy")
+        points_path = os.path.join(course_dir, "points.json")
+        with open(f"{vectors_path}.tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(index.vectors, dtype=np.float32))
+        with open(f"{points_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"ids": index.ids, "payloads": index.payloads}, f, ensure_ascii=False)
+        os.replace(f"{vectors_path}.tmp", vectors_path)
+        os.replace(f"{points_path}.tmp", points_path)
+        return _CourseIndex(index.ids, index.payloads, np.load(vectors_path, mmap_mode="r"))
+
+    # --- Escrita ---
+
+    def upsert_documents(self,
+                         documents: List[Document],
+                         embeddings: np.ndarray | List[List[float]],
+                         id_course: str,
+                         batch_size: int = 100,
+                         skip_unchanged: bool = True,
+                         sparse_embeddings: Optional[List[Any]] = None):
+        """Mesma semântica de `VectorStoreService.upsert_documents` (IDs determinísticos, pontos inalterados ignorados)."""
+        if not documents or embeddings is None or len(documents) != len(embeddings):
+            print("Erro: documentos e embeddings não podem ser vazios ou de tamanhos diferentes.")
+            return False
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != self.vector_size:
+            print(f"Erro: matriz de embeddings com formato {vectors.shape} incompatível com a dimensão {self.vector_size}.")
+            return False
+
+        report = VectorStoreService._new_batch_report(1, len(documents))
+        report["attempts"] = 1
+        ids, payloads = VectorStoreService._prepare_batch_payloads(documents, id_course)
+        with self._write_lock:
+            current = self._courses.get(id_course)
+            new_ids = list(current.ids) if current else []
+            new_payloads = list(current.payloads) if current else []
+            row_by_id = dict(current.row_by_id) if current else {}
+            existing_rows = len(new_ids)
+            updates: Dict[int, int] = {}
+            appended: List[int] = []
+            for position, (point_id, payload) in enumerate(zip(ids, payloads)):
+                row = row_by_id.get(point_id)
+                if row is None:
+                    row_by_id[point_id] = len(new_ids)
+                    new_ids.append(point_id)
+                    new_payloads.append(payload)
+                    appended.append(position)
+                elif skip_unchanged and is_unchanged_payload(new_payloads[row], payload):
+                    report["skipped"] += 1
+                elif row >= existing_rows:
+                    # ID repetido dentro do mesmo upsert: prevalece a última ocorrência
+                    new_payloads[row] = payload
+                    appended[row - existing_rows] = position
+                else:
+                    new_payloads[row] = payload
+                    updates[row] = position
+
+            if appended or updates:
+                normalized = self._normalize(vectors)
+                base = np.array(current.vectors) if current else np.empty((0, self.vector_size), dtype=np.float32)
+                if updates:
+                    base[list(updates.keys())] = normalized[list(updates.values())]
+                new_vectors = np.concatenate([base, normalized[appended]]) if appended else base
+                self._courses[id_course] = self._persist(id_course, _CourseIndex(new_ids, new_payloads, new_vectors))
+            report["upserted"] = len(appended) + len(updates)
+            report["success"] = True
+
+        self.last_upsert_report = [report]
+        print(f"Curso ID: {id_course} - Backend NumPy: {report['upserted']} pontos gravados, {report['skipped']} inalterados "
+              f"({len(self._courses[id_course].ids) if id_course in self._courses else 0} no curso).")
+        return True
+
+    def delete_points(self, id_course: str, point_ids: List[str], batch_size: int = 1000) -> bool:
+        """Remove pontos pelo ID e regrava o índice do curso."""
+        to_delete = set(point_ids)
+        with self._write_lock:
+            current = self._courses.get(id_course)
+            if current is None or not to_delete:
+                return True
+            keep = [row for row, point_id in enumerate(current.ids) if point_id not in to_delete]
+            if len(keep) == len(current.ids):
+                return True
+            index = _CourseIndex(
+                [current.ids[row] for row in keep],
+                [current.payloads[row] for row in keep],
+                np.asarray(current.vectors[keep], dtype=np.float32).reshape(len(keep), self.vector_size)
+            )
+            self._courses[id_course] = self._persist(id_course, index)
+        print(f"Curso ID: {id_course} - Backend NumPy: {len(current.ids) - len(keep)} pontos removidos.")
+        return True
+
+    # --- Leitura ---
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    @staticmethod
+    def _filter_conditions(filter: Optional[models.Filter]) -> Dict[str, Any]:
+        """Converte o filtro em {campo: valor}; só condições `must` com MatchValue são suportadas."""
+        if filter is None:
+            return {}
+        if filter.should or filter.must_not or filter.min_should:
+            raise ValueError("Backend NumPy suporta apenas filtros 'must' com MatchValue.")
+        conditions = {}
+        for condition in filter.must or []:
+            if not isinstance(condition, models.FieldCondition) or not isinstance(condition.match, models.MatchValue):
+                raise ValueError(f"Condição de filtro não suportada pelo backend NumPy: {condition}")
+            conditions[condition.key] = condition.match.value
+        return conditions
+
+    def _candidate_indexes(self, conditions: Dict[str, Any]) -> List[tuple]:
+        """Pares (índice do curso, máscara de linhas ou None) que satisfazem o filtro."""
+        course_id = conditions.pop("course_id", None)
+        if course_id is not None:
+            index = self._courses.get(str(course_id))
+            indexes = [index] if index is not None else []
+        else:
+            indexes = list(self._courses.values())
+        result = []
+        for index in indexes:
+            mask = None
+            if conditions:
+                mask = np.fromiter(
+                    (all(p.get(k) == v for k, v in conditions.items()) for p in index.payloads),
+                    dtype=bool, count=len(index.payloads)
+                )
+            result.append((index, mask))
+        return result
+
+    @staticmethod
+    def _make_hit(index: _CourseIndex, row: int, score: float, payload_fields: Optional[Sequence[str]],
+                  with_vectors: bool = False) -> SearchHit:
+        payload = index.payloads[row]
+        if payload_fields is not None:
+            payload = {k: payload[k] for k in payload_fields if k in payload}
+        payload = dict(payload)
+        return SearchHit(
+            id=index.ids[row],
+            score=score,
+            text=payload.pop("text", ""),
+            source=payload.pop("source", "desconhecido"),
+            page=payload.pop("page", -1),
+            course_id=payload.pop("course_id", "desconhecido"),
+            extra=payload or None,
+            vector=np.array(index.vectors[row]) if with_vectors else None
+        )
+
+    def search(self,
+               query_vector: List[float],
+               limit: int = 3,
+               filter: Optional[models.Filter] = None,
+               oversampling: Optional[float] = None,
+               rescore: Optional[bool] = None,
+               sparse_vector: Optional[Any] = None,
+               payload_fields: Optional[Sequence[str]] = SEARCH_PAYLOAD_FIELDS,
+               with_vectors: bool = False) -> List[SearchHit]:
+        """Busca exata por similaridade de cosseno. `oversampling`, `rescore` e `sparse_vector` são ignorados."""
+        if query_vector is None or len(query_vector) == 0:
+            print("Erro: Vetor de busca vazio.")
+            return []
+        try:
+            candidates = self._candidate_indexes(self._filter_conditions(filter))
+        except ValueError as e:
+            print(f"Erro durante a busca vetorial: {e}")
+            return []
+
+        query = self._normalize(np.asarray(query_vector, dtype=np.float32))
+        best: List[tuple] = []
+        for index, mask in candidates:
+            if not len(index.ids):
+                continue
+            scores = index.vectors @ query
+            if mask is not None:
+                scores = np.where(mask, scores, -np.inf)
+            k = min(limit, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            best.extend((float(scores[row]), index, int(row)) for row in top if np.isfinite(scores[row]))
+        best.sort(key=lambda item: item[0], reverse=True)
+        return [self._make_hit(index, row, score, payload_fields, with_vectors) for score, index, row in best[:limit]]
+
+    def search_batch(self,
+                     queries: List[SearchQuery],
+                     oversampling: Optional[float] = None,
+                     rescore: Optional[bool] = None) -> List[List[SearchHit]]:
+        return [
+            self.search(q.query_vector, q.limit, q.filter, payload_fields=q.payload_fields, with_vectors=q.with_vectors)
+            for q in queries
+        ]
+
+    def has_source(self, course_id: str, source: str) -> bool:
+        index = self._courses.get(str(course_id))
+        return index is not None and any(p.get("source") == source for p in index.payloads)
+
+    def iter_course_payloads(self,
+                             course_id: str,
+                             page_size: int = 100,
+                             fields: Optional[List[str]] = None,
+                             max_items: Optional[int] = None,
+                             offset: Optional[Any] = None) -> Iterator[List[Dict[str, Any]]]:
+        """Mesmo contrato de `VectorStoreService.iter_course_payloads`; `offset` é a posição no curso."""
+        index = self._courses.get(str(course_id))
+        if index is None:
+            return
+        end = len(index.ids) if max_items is None else min(len(index.ids), (offset or 0) + max_items)
+        for start in range(offset or 0, end, page_size):
+            page = []
+            for row in range(start, min(start + page_size, end)):
+                payload = index.payloads[row]
+                if fields is not None:
+                    payload = {k: payload[k] for k in fields if k in payload}
+                page.append({"id": index.ids[row], **payload})
+            yield page
+
+    def get_all_by_course_id(self, course_id_filter: str, limit: int = 1000, offset: Optional[Any] = None) -> List[Dict[str, Any]]:
+        if not course_id_filter:
+            print("Erro: Filtro de ID do curso vazio.")
+            return []
+        all_payloads: List[Dict[str, Any]] = []
+        for page in self.iter_course_payloads(course_id_filter, page_size=1000, max_items=limit, offset=offset):
+            all_payloads.extend(page)
+        return all_payloads
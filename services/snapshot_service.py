@@ -0,0 +1,170 @@
+import os
+import json
+import time
+from typing import List, Dict, Any, Optional
+import numpy as np
+from qdrant_client import models
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.settings import settings
+from services.vector_store_service import VectorStoreService, course_payload_cache
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+def _json_bytes(value: Any) -> np.ndarray:
+    return np.frombuffer(json.dumps(value, ensure_ascii=False).encode("utf-8"), dtype=np.uint8)
+
+
+def _json_from_bytes(array: np.ndarray) -> Any:
+    return json.loads(array.tobytes().decode("utf-8"))
+
+
+class SnapshotService:
+    """
+    Exporta/importa pontos da coleção (vetores densos, esparsos e payloads)
+    para um arquivo .npz compacto, sem pickle. Permite subir um nó novo (ou
+    um processo em modo 'memory') carregando o arquivo em vez de reprocessar
+    e re-embedar os PDFs.
+
+    Conteúdo do arquivo: `meta` e `payloads` (JSON em bytes), `ids`,
+    `vectors` (float32, n x dim) e, se houver, os vetores esparsos em
+    formato CSR (`sparse_indptr`, `sparse_indices`, `sparse_values`).
+    """
+
+    def __init__(self, vector_store_service: VectorStoreService, page_size: int = 256):
+        if not isinstance(vector_store_service, VectorStoreService):
+            raise ValueError("Snapshots exigem o backend 'qdrant' (o backend NumPy já persiste os vetores em disco).")
+        self.vector_store = vector_store_service
+        self.client = vector_store_service.client
+        self.collection_name = vector_store_service.collection_name
+        self.page_size = page_size
+
+    def export(self, path: str, course_id: Optional[str] = None) -> Dict[str, Any]:
+        """Grava os pontos de um curso (ou da coleção inteira) em `path`. Retorna um resumo."""
+        start_time = time.time()
+        scroll_filter = self.vector_store._course_filter(course_id) if course_id else None
+        total = self.client.count(collection_name=self.collection_name, count_filter=scroll_filter, exact=True).count
+        print(f"Exportando {total} pontos de '{self.collection_name}' (curso: {course_id or 'todos'}) para {path}...")
+
+        sparse_name = self.vector_store.sparse_vector_name
+        ids: List[str] = []
+        payloads: List[Dict[str, Any]] = []
+        vectors = np.empty((total, self.vector_store.vector_size), dtype=np.float32)
+        sparse_indptr = [0]
+        sparse_indices: List[np.ndarray] = []
+        sparse_values: List[np.ndarray] = []
+
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=scroll_filter,
+                limit=self.page_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True
+            )
+            for point in points:
+                row = len(ids)
+                if row >= total:
+                    # Pontos inseridos durante a exportação ficam para o próximo snapshot
+                    break
+                vector = point.vector
+                dense = vector.get("", None) if isinstance(vector, dict) else vector
+                sparse = vector.get(sparse_name) if isinstance(vector, dict) else None
+                vectors[row] = dense
+                if sparse is not None:
+                    sparse_indices.append(np.asarray(sparse.indices, dtype=np.uint32))
+                    sparse_values.append(np.asarray(sparse.values, dtype=np.float32))
+                sparse_indptr.append(sparse_indptr[-1] + (len(sparse.indices) if sparse is not None else 0))
+                ids.append(str(point.id))
+                payloads.append(point.payload or {})
+            if offset is None or not points or len(ids) >= total:
+                break
+        vectors = vectors[:len(ids)]
+
+        meta = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "collection": self.collection_name,
+            "course_id": course_id,
+            "points": len(ids),
+            "vector_size": self.vector_store.vector_size,
+            "embedding_model": settings.embedding_model_name,
+            "sparse_vector_name": sparse_name if sparse_indices else None,
+            "created_at": time.time(),
+        }
+        arrays = {
+            "meta": _json_bytes(meta),
+            "ids": np.asarray(ids, dtype=str),
+            "vectors": vectors,
+            "payloads": _json_bytes(payloads),
+        }
+        if sparse_indices:
+            arrays["sparse_indptr"] = np.asarray(sparse_indptr, dtype=np.int64)
+            arrays["sparse_indices"] = np.concatenate(sparse_indices)
+            arrays["sparse_values"] = np.concatenate(sparse_values)
+
+        # Escreve em arquivo temporário e renomeia: um snapshot nunca fica pela metade
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, path)
+
+        summary = {**meta, "path": path, "bytes": os.path.getsize(path), "seconds": time.time() - start_time}
+        print(f"Snapshot exportado: {summary['points']} pontos, {summary['bytes'] / (1024 * 1024):.1f} MB em {summary['seconds']:.2f}s.")
+        return summary
+
+    def restore(self, path: str, only_if_empty: bool = False) -> Dict[str, Any]:
+        """
+        Carrega um snapshot na coleção (upsert pelos IDs originais, portanto
+        idempotente). Com `only_if_empty`, não faz nada se a coleção já tiver pontos.
+        """
+        start_time = time.time()
+        if only_if_empty:
+            existing = self.client.count(collection_name=self.collection_name, exact=True).count
+            if existing:
+                print(f"Coleção '{self.collection_name}' já possui {existing} pontos; snapshot {path} não foi restaurado.")
+                return {"path": path, "points": 0, "skipped": True}
+
+        with np.load(path, allow_pickle=False) as data:
+            meta = _json_from_bytes(data["meta"])
+            if meta.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+                raise ValueError(f"Versão de snapshot não suportada: {meta.get('format_version')}")
+            if meta["vector_size"] != self.vector_store.vector_size:
+                raise ValueError(f"Snapshot com vetores de dimensão {meta['vector_size']}, "
+                                 f"mas a coleção usa {self.vector_store.vector_size}.")
+            if meta.get("embedding_model") != settings.embedding_model_name:
+                print(f"Aviso: snapshot gerado com o modelo '{meta.get('embedding_model')}', "
+                      f"mas o modelo configurado é '{settings.embedding_model_name}'.")
+            ids = data["ids"].tolist()
+            vectors = data["vectors"]
+            payloads = _json_from_bytes(data["payloads"])
+            has_sparse = "sparse_indptr" in data.files and self.vector_store.hybrid_enabled
+            if has_sparse:
+                sparse_indptr = data["sparse_indptr"]
+                sparse_indices = data["sparse_indices"]
+                sparse_values = data["sparse_values"]
+
+        print(f"Restaurando {len(ids)} pontos do snapshot {path} em '{self.collection_name}'...")
+        for start in range(0, len(ids), self.page_size):
+            end = min(start + self.page_size, len(ids))
+            batch_sparse = None
+            if has_sparse:
+                batch_sparse = [
+                    models.SparseVector(
+                        indices=sparse_indices[sparse_indptr[k]:sparse_indptr[k + 1]].tolist(),
+                        values=sparse_values[sparse_indptr[k]:sparse_indptr[k + 1]].tolist()
+                    )
+                    for k in range(start, end)
+                ]
+            points = self.vector_store._build_batch_points(ids[start:end], payloads[start:end], vectors[start:end], batch_sparse)
+            self.client.upsert(collection_name=self.collection_name, wait=True, points=points)
+
+        for restored_course_id in {p.get("course_id") for p in payloads if p.get("course_id")}:
+            course_payload_cache.invalidate(self.collection_name, restored_course_id)
+
+        summary = {**meta, "path": path, "points": len(ids), "skipped": False, "seconds": time.time() - start_time}
+        print(f"Snapshot restaurado: {len(ids)} pontos em {summary['seconds']:.2f}s.")
+        return summary
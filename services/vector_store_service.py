@@ -1,24 +1,222 @@
-from typing import List, Dict, Any, Optional 
+from typing import List, Dict, Any, Optional, Iterator, Sequence
+import numpy as np
 from qdrant_client import QdrantClient, models
-from qdrant_client.http.models import PointStruct
 from langchain_core.documents import Document
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.settings import settings
 import math
+import time
 import uuid 
-from config.settings import settings
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+
+# Namespace fixo para IDs determinísticos (UUIDv5) dos pontos
+POINT_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "chat-edu/qdrant-points")
+
+
+def content_hash(text: str) -> str:
+    """Hash SHA-256 do texto do chunk."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Campos do payload que, iguais aos do ponto armazenado, permitem pular o reenvio (skip_unchanged):
+# o texto e o modelo que gerou o vetor (trocar de modelo com a mesma dimensão exige regravar os vetores)
+UNCHANGED_CHECK_FIELDS = ["content_hash", "embedding_model"]
+
+
+def is_unchanged_payload(stored_payload: Optional[Dict[str, Any]], payload: Dict[str, Any]) -> bool:
+    if not stored_payload:
+        return False
+    return all(stored_payload.get(field) == payload[field] for field in UNCHANGED_CHECK_FIELDS)
+
+
+def make_point_id(course_id: str, source: Any, page: Any, chunk_index: Any = None, text_hash: Optional[str] = None) -> str:
+    """
+    Gera um ID determinístico (UUIDv5) a partir de curso, arquivo, página e
+    índice do chunk, para que a reingestão sobrescreva os pontos no lugar.
+    Sem `chunk_index`, usa o hash do conteúdo como discriminador.
+    """
+    source_name = os.path.basename(str(source))
+    discriminator = chunk_index if chunk_index is not None else text_hash
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{course_id}|{source_name}|{page}|{discriminator}"))
+
+def document_point_id(doc: Document, course_id: str) -> str:
+    """ID do ponto que `upsert_documents` grava para o chunk `doc` do curso."""
+    metadata = doc.metadata
+    chunk_index = metadata.get('chunk_index')
+    return make_point_id(course_id, metadata.get('source', 'desconhecido'), metadata.get('page', -1), chunk_index,
+                         content_hash(doc.page_content) if chunk_index is None else None)
+
+
+# Campos do payload trazidos por padrão nas buscas (o necessário para montar contexto e fontes)
+SEARCH_PAYLOAD_FIELDS = ("text", "source", "page", "course_id")
+
+
+@dataclass(slots=True)
+class SearchHit:
+    """
+    Resultado compacto de busca. Os campos padrão do payload viram atributos;
+    campos adicionais pedidos via `payload_fields` ficam em `extra`. `vector`
+    (float32) só é preenchido em buscas com `with_vectors=True`.
+    """
+    id: Any
+    score: float
+    text: str = ""
+    source: Any = "desconhecido"
+    page: Any = -1
+    course_id: Any = "desconhecido"
+    extra: Optional[Dict[str, Any]] = None
+    vector: Optional[np.ndarray] = None
+
+
+@dataclass
+class SearchQuery:
+    """Uma consulta de `VectorStoreService.search_batch`: vetor, limite e filtro próprios."""
+    query_vector: List[float]
+    limit: int = 3
+    filter: Optional[models.Filter] = None
+    sparse_vector: Optional[Any] = None
+    payload_fields: Optional[Sequence[str]] = SEARCH_PAYLOAD_FIELDS
+    with_vectors: bool = False
+
+
+class CoursePayloadCache:
+    """
+    Cache em memória, compartilhado pelo processo, dos payloads de cada curso
+    (resultado de `get_all_by_course_id`). Limitado por um orçamento de bytes
+    (estimado pelo tamanho dos valores) com despejo LRU. Cada curso tem uma
+    versão incrementada a cada escrita; leituras iniciadas antes de uma escrita
+    não são gravadas no cache. O TTL cobre escritas feitas por outros processos.
+    Os payloads (planos: texto e metadados escalares) são copiados na gravação e
+    em cada leitura, para que uma requisição que altere a lista ou os dicts
+    recebidos não afete o cache nem as demais requisições.
+    """
+    _PAYLOAD_OVERHEAD_BYTES = 200
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.current_bytes = 0
+        # chave (coleção, curso) -> (criado_em, payloads, completo, bytes)
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._versions: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _estimate_bytes(cls, payloads: List[Dict[str, Any]]) -> int:
+        return sum(
+            cls._PAYLOAD_OVERHEAD_BYTES + sum(len(str(v)) for v in payload.values())
+            for payload in payloads
+        )
+
+    def version(self, collection_name: str, course_id: str) -> int:
+        with self._lock:
+            return self._versions.get((collection_name, course_id), 0)
+
+    def get(self, collection_name: str, course_id: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        key = (collection_name, course_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl_seconds:
+                self._drop_locked(key)
+                entry = None
+            # Serve se o curso foi lido por completo ou se há itens suficientes para o limite pedido
+            if entry is not None and (entry[2] or len(entry[1]) >= limit):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return [dict(payload) for payload in entry[1][:limit]]
+            self.misses += 1
+            return None
+
+    def put(self, collection_name: str, course_id: str, payloads: List[Dict[str, Any]], complete: bool, version: int):
+        key = (collection_name, course_id)
+        size = self._estimate_bytes(payloads)
+        if size > self.max_bytes:
+            return
+        payloads = [dict(payload) for payload in payloads]
+        with self._lock:
+            if self._versions.get(key, 0) != version:
+                return  # Houve escrita no curso durante a leitura; não armazena dado possivelmente desatualizado
+            self._drop_locked(key)
+            self._entries[key] = (time.monotonic(), payloads, complete, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes and self._entries:
+                self._drop_locked(next(iter(self._entries)))
+
+    def invalidate(self, collection_name: str, course_id: str):
+        key = (collection_name, course_id)
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._drop_locked(key)
+
+    def _drop_locked(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[3]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "courses": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# Instância única por processo, compartilhada por todos os VectorStoreService
+course_payload_cache = CoursePayloadCache(
+    max_bytes=settings.course_cache_max_bytes,
+    ttl_seconds=settings.course_cache_ttl_seconds
+)
+
+# O modo 'local' trava a pasta de armazenamento: um segundo QdrantClient(path=...) no mesmo
+# processo falha, então todos os VectorStoreService reaproveitam o cliente já aberto
+_local_clients: Dict[str, QdrantClient] = {}
+_local_clients_lock = threading.Lock()
+
+
+def _get_local_client(path: str) -> QdrantClient:
+    path = os.path.abspath(path)
+    with _local_clients_lock:
+        client = _local_clients.get(path)
+        if client is None:
+            os.makedirs(path, exist_ok=True)
+            client = QdrantClient(path=path)
+            _local_clients[path] = client
+        return client
+
 
 class VectorStoreService:
     def __init__(self, vector_size: int):
         self.collection_name = settings.qdrant_collection_name
         self.vector_size = vector_size 
+        self.last_upsert_report: List[Dict[str, Any]] = []
+        # (curso, fonte) já verificados quanto a pontos com IDs aleatórios da versão anterior
+        self._legacy_checked: set = set()
+        self.sparse_vector_name = settings.sparse_vector_name
+        # Definido em _setup_collection conforme a coleção tenha (ou não) vetores esparsos
+        self.hybrid_enabled = False
         print(f"Inicializando VectorStoreService para coleção: {self.collection_name}")
 
+        # Em modo local o cliente roda no próprio processo e aceita arrays NumPy diretamente
+        self.is_local = settings.qdrant_mode != "url"
         if settings.qdrant_mode == "memory":
             print("Usando Qdrant in-memory")
             self.client = QdrantClient(":memory:")
+        elif settings.qdrant_mode == "local":
+            print(f"Usando Qdrant local persistido em disco: {settings.qdrant_local_path}")
+            self.client = _get_local_client(settings.qdrant_local_path)
         elif settings.qdrant_mode == "url":
             print(f"Conectando ao Qdrant em {settings.qdrant_url}")
             self.client = QdrantClient(
@@ -30,21 +228,39 @@ class VectorStoreService:
             raise ValueError(f"Modo qdrant inválido {settings.qdrant_mode}.")
         self._setup_collection()
         # É uma boa prática garantir que campos usados para filtragem estejam indexados
-        self._ensure_payload_index("course_id")
-        # Você também pode querer indexar 'source' se for filtrar por ele frequentemente
-        # self._ensure_payload_index("source")
+        if settings.qdrant_multitenancy:
+            # course_id como tenant: o Qdrant agrupa o armazenamento por curso e monta um grafo HNSW por tenant
+            self._ensure_payload_index(
+                "course_id",
+                models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True)
+            )
+            self._configure_tenant_hnsw()
+            # payload_m monta um subgrafo HNSW por valor de cada campo indexado; em 'source' seria um por PDF.
+            # has_source filtra primeiro pelo tenant, então dispensa o índice
+            self._drop_payload_index("source")
+        else:
+            self._ensure_payload_index("course_id")
+            self._restore_global_hnsw()
+            # 'source' é usado para detectar PDFs já indexados no startup (has_source)
+            self._ensure_payload_index("source")
 
 
     def _setup_collection(self):
         print(f"Verificando/Configurando coleção: {self.collection_name}")
         try:
-            self.client.get_collection(collection_name=self.collection_name)
+            collection_info = self.client.get_collection(collection_name=self.collection_name)
             print(f"Coleção '{self.collection_name}' já existe. Usando a existente.")
+            sparse_vectors = collection_info.config.params.sparse_vectors or {}
+            self.hybrid_enabled = settings.hybrid_search_enabled and self.sparse_vector_name in sparse_vectors
+            if settings.hybrid_search_enabled and not self.hybrid_enabled:
+                print(f"Aviso: a coleção '{self.collection_name}' não possui o vetor esparso '{self.sparse_vector_name}'. "
+                      "Busca híbrida desativada (recrie a coleção para habilitá-la).")
         except Exception as e:
             error_message = str(e)
             # Se for erro 403 (Forbidden), assumir que a coleção existe mas não temos permissão para get_collection
             if "403" in error_message or "Forbidden" in error_message or "forbidden" in error_message:
                 print(f"Aviso: Erro 403 ao verificar coleção. Assumindo que '{self.collection_name}' já existe (permissões limitadas da API key).")
+                self.hybrid_enabled = settings.hybrid_search_enabled
                 return
             
             # Para outros erros, tentar criar a coleção
@@ -55,26 +271,143 @@ class VectorStoreService:
                     vectors_config=models.VectorParams(
                         size=self.vector_size,
                         distance=models.Distance.COSINE
-                    )
+                    ),
+                    quantization_config=self._build_quantization_config(),
+                    # O grafo global só é desligado (m=0) depois de confirmado o índice de tenant
+                    hnsw_config=self._build_tenant_hnsw_config(disable_global_index=False),
+                    sparse_vectors_config={
+                        # IDF calculado pelo Qdrant; o TF saturado (BM25) vem do modelo esparso
+                        self.sparse_vector_name: models.SparseVectorParams(modifier=models.Modifier.IDF)
+                    } if settings.hybrid_search_enabled else None
                 )
-                print(f"Coleção '{self.collection_name}' criada com sucesso.")
+                self.hybrid_enabled = settings.hybrid_search_enabled
+                print(f"Coleção '{self.collection_name}' criada com sucesso (busca híbrida: {self.hybrid_enabled}).")
             except Exception as create_e:
                 create_error_message = str(create_e)
                 # Se também der 403 ao criar, assumir que já existe
                 if "403" in create_error_message or "Forbidden" in create_error_message or "forbidden" in create_error_message:
                     print(f"Aviso: Erro 403 ao criar coleção. Assumindo que '{self.collection_name}' já existe (permissões limitadas da API key).")
+                    self.hybrid_enabled = settings.hybrid_search_enabled
                     return
                 print(f"Erro CRÍTICO ao TENTAR CRIAR a coleção '{self.collection_name}': {type(create_e).__name__} - {create_e}")
                 raise RuntimeError(f"Falha ao garantir a existência/criação da coleção '{self.collection_name}': {create_e}")
 
 
-    def _ensure_payload_index(self, field_name: str, field_type: models.PayloadSchemaType = models.PayloadSchemaType.KEYWORD):
+    def _build_quantization_config(self) -> Optional[models.QuantizationConfig]:
+        """Monta a configuração de quantização definida em QDRANT_QUANTIZATION."""
+        mode = settings.qdrant_quantization
+        if mode == "scalar":
+            print(f"Usando quantização escalar (int8) na coleção '{self.collection_name}'.")
+            return models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=settings.qdrant_quantization_always_ram
+                )
+            )
+        if mode == "binary":
+            print(f"Usando quantização binária na coleção '{self.collection_name}'.")
+            return models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(always_ram=settings.qdrant_quantization_always_ram)
+            )
+        return None
+
+    def _build_search_params(self, oversampling: Optional[float], rescore: Optional[bool]) -> Optional[models.SearchParams]:
+        """Parâmetros de busca sobre vetores quantizados (oversampling + rescoring com os vetores originais)."""
+        if settings.qdrant_quantization == "none":
+            return None
+        return models.SearchParams(
+            quantization=models.QuantizationSearchParams(
+                ignore=False,
+                rescore=settings.qdrant_search_rescore if rescore is None else rescore,
+                oversampling=settings.qdrant_search_oversampling if oversampling is None else oversampling
+            )
+        )
+
+    def _build_tenant_hnsw_config(self, disable_global_index: bool = True) -> Optional[models.HnswConfigDiff]:
+        """
+        HNSW por curso (payload_m) para o layout multi-tenant. Com
+        QDRANT_TENANT_DISABLE_GLOBAL_INDEX (e `disable_global_index`) o grafo
+        global não é construído (m=0): buscas sem filtro de curso passam a ser exaustivas.
+        """
+        if not settings.qdrant_multitenancy:
+            return None
+        return models.HnswConfigDiff(
+            payload_m=settings.qdrant_tenant_payload_m,
+            m=0 if disable_global_index and settings.qdrant_tenant_disable_global_index else None
+        )
+
+    def _configure_tenant_hnsw(self):
+        """Aplica a configuração HNSW por tenant também a coleções já existentes (reindexação em segundo plano no servidor)."""
+        # Sem o índice de tenant confirmado, m=0 deixaria a coleção sem nenhum grafo HNSW
+        tenant_index_ready = self._is_tenant_index(self._payload_index_info("course_id"))
+        if not tenant_index_ready and settings.qdrant_tenant_disable_global_index:
+            print("Aviso: índice de tenant em 'course_id' não confirmado; mantendo o grafo HNSW global (m).")
+        desired = self._build_tenant_hnsw_config(disable_global_index=tenant_index_ready)
+        try:
+            current = self.client.get_collection(collection_name=self.collection_name).config.hnsw_config
+            if not tenant_index_ready and current.m == 0:
+                # Grafo global desligado sem índice de tenant: restaura o padrão do Qdrant
+                desired.m = 16
+            if current.payload_m == desired.payload_m and (desired.m is None or current.m == desired.m):
+                return
+            self.client.update_collection(
+                collection_name=self.collection_name,
+                hnsw_config=desired
+            )
+            print(f"Configuração HNSW multi-tenant (por course_id) aplicada à coleção '{self.collection_name}'.")
+        except Exception as e:
+            print(f"Aviso: não foi possível aplicar a configuração HNSW multi-tenant: {type(e).__name__} - {e}")
+
+    def _restore_global_hnsw(self):
+        """Coleção que já rodou multi-tenant (m=0) com QDRANT_MULTITENANCY desligado: volta ao grafo global."""
+        try:
+            current = self.client.get_collection(collection_name=self.collection_name).config.hnsw_config
+            if current.m != 0:
+                return
+            self.client.update_collection(
+                collection_name=self.collection_name,
+                hnsw_config=models.HnswConfigDiff(m=16, payload_m=0)
+            )
+            print(f"Grafo HNSW global restaurado (m=16, payload_m=0) na coleção '{self.collection_name}'.")
+        except Exception as e:
+            print(f"Aviso: não foi possível restaurar o grafo HNSW global: {type(e).__name__} - {e}")
+
+    def _payload_index_info(self, field_name: str) -> Optional[models.PayloadIndexInfo]:
+        """Índice de payload existente para o campo (None se não houver ou não for possível consultar)."""
+        try:
+            collection_info = self.client.get_collection(collection_name=self.collection_name)
+        except Exception as e:
+            print(f"Aviso: não foi possível consultar os índices de payload: {type(e).__name__} - {e}")
+            return None
+        return (collection_info.payload_schema or {}).get(field_name)
+
+    @staticmethod
+    def _is_tenant_index(index_info: Optional[models.PayloadIndexInfo]) -> bool:
+        return bool(index_info is not None and getattr(index_info.params, 'is_tenant', False))
+
+    def _drop_payload_index(self, field_name: str):
+        if self._payload_index_info(field_name) is None:
+            return
+        try:
+            self.client.delete_payload_index(collection_name=self.collection_name, field_name=field_name)
+            print(f"Índice de payload '{field_name}' removido da coleção '{self.collection_name}'.")
+        except Exception as e:
+            print(f"Aviso: não foi possível remover o índice de payload '{field_name}': {type(e).__name__} - {e}")
+
+    def _ensure_payload_index(self, field_name: str, field_type: models.PayloadSchemaType | models.KeywordIndexParams = models.PayloadSchemaType.KEYWORD):
         try:
             collection_info = self.client.get_collection(collection_name=self.collection_name)
             current_schema = getattr(collection_info.config.params, 'payload_schema', {}) 
             if not current_schema: 
                  current_schema = collection_info.payload_schema or {}
 
+            wants_tenant = bool(getattr(field_type, 'is_tenant', False))
+            if field_name in current_schema and self._is_tenant_index(current_schema[field_name]) != wants_tenant:
+                # Coleções anteriores ao layout multi-tenant (ou que o desligaram): o índice é recriado
+                print(f"Índice de payload '{field_name}' existe com is_tenant={not wants_tenant}; recriando com is_tenant={wants_tenant}...")
+                self.client.delete_payload_index(collection_name=self.collection_name, field_name=field_name)
+                current_schema = {k: v for k, v in current_schema.items() if k != field_name}
 
             if field_name not in current_schema:
                 print(f"Criando indice payload para o campo '{field_name}' na coleção '{self.collection_name}'...")
@@ -93,167 +426,521 @@ class VectorStoreService:
 
     def upsert_documents(self,
                          documents: List[Document],
-                         embeddings: List[List[float]],
+                         embeddings: np.ndarray | List[List[float]],
                          id_course: str,
-                         batch_size: int = 100):
-        if not documents or not embeddings or len(documents) != len(embeddings):
-            print("Erro: documentos e embeddings não podem ser vazios ou de tamanhos diferentes.")
+                         batch_size: int = 100,
+                         skip_unchanged: bool = True,
+                         sparse_embeddings: Optional[List[Any]] = None):
+        """
+        Insere/atualiza documentos no Qdrant. `embeddings` deve ser uma matriz
+        float32 (n, dim) — listas de floats ainda são aceitas e convertidas.
+        Os IDs são determinísticos (curso, fonte, página, chunk); com
+        `skip_unchanged`, pontos já existentes com o mesmo conteúdo não são reenviados.
+        `sparse_embeddings` (objetos com `indices`/`values`) são gravados quando a busca híbrida está ativa.
+        """
+        # O cliente local (in-process) não é thread-safe: lotes em paralelo só no modo 'url'
+        parallelism = 1 if self.is_local else max(1, settings.qdrant_upsert_parallelism)
+        batch_args = self._plan_upsert_batches(documents, embeddings, id_course, batch_size, skip_unchanged,
+                                               sparse_embeddings, parallelism)
+        if batch_args is None:
             return False
+        legacy = self._legacy_points_filter(documents, id_course)
+        if legacy is not None:
+            legacy_filter, legacy_keys = legacy
+            try:
+                self.client.delete(
+                    collection_name=self.collection_name,
+                    points_selector=models.FilterSelector(filter=legacy_filter),
+                    wait=True
+                )
+                self._legacy_checked.update(legacy_keys)
+            except Exception as e:
+                print(f"Aviso: falha ao remover pontos legados (sem content_hash) do curso {id_course}: {type(e).__name__} - {e}")
+
+        if parallelism == 1:
+            reports = [self._upsert_batch(*args) for args in batch_args]
+        else:
+            with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="qdrant-upsert") as executor:
+                reports = list(executor.map(lambda args: self._upsert_batch(*args), batch_args))
+        return self._finish_upsert(reports, id_course)
+
+    def _legacy_points_filter(self, documents: List[Document], id_course: str) -> Optional[tuple]:
+        """
+        Filtro dos pontos gravados antes dos IDs determinísticos (uuid4 aleatório,
+        sem content_hash) das fontes deste upsert: sem removê-los a primeira
+        reingestão duplicaria os chunks. Cada (curso, fonte) é verificado uma
+        vez por processo. Retorna (filtro, chaves) ou None.
+        """
+        sources = {str(doc.metadata.get('source', 'desconhecido')) for doc in documents}
+        pending = sorted(source for source in sources if (id_course, source) not in self._legacy_checked)
+        if not pending:
+            return None
+        legacy_filter = models.Filter(
+            must=[
+                models.FieldCondition(key="course_id", match=models.MatchValue(value=id_course)),
+                models.FieldCondition(key="source", match=models.MatchAny(any=pending)),
+                models.IsEmptyCondition(is_empty=models.PayloadField(key="content_hash")),
+            ]
+        )
+        return legacy_filter, [(id_course, source) for source in pending]
+
+    def _plan_upsert_batches(self,
+                             documents: List[Document],
+                             embeddings: np.ndarray | List[List[float]],
+                             id_course: str,
+                             batch_size: int,
+                             skip_unchanged: bool,
+                             sparse_embeddings: Optional[List[Any]],
+                             parallelism: int) -> Optional[List[tuple]]:
+        """Valida as entradas e divide o upsert em argumentos de `_upsert_batch` (None se inválidas)."""
+        if not documents or embeddings is None or len(documents) != len(embeddings):
+            print("Erro: documentos e embeddings não podem ser vazios ou de tamanhos diferentes.")
+            return None
+
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != self.vector_size:
+            print(f"Erro: matriz de embeddings com formato {vectors.shape} incompatível com a dimensão {self.vector_size}.")
+            return None
 
         total_docs = len(documents)
         num_batches = math.ceil(total_docs / batch_size)
-        print(f"Curso ID: {id_course}) Preparando para inserir/atualizar {total_docs} pontos em {num_batches} lotes de até {batch_size} pontos cada...")
-
-        all_successful = True
-
-        for i in range(num_batches):
-            start_index = i * batch_size
-            end_index = min((i + 1) * batch_size, total_docs)
-            current_batch_docs = documents[start_index:end_index]
-            current_batch_embeddings = embeddings[start_index:end_index]
-
-            points_to_insert: List[PointStruct] = []
-            for j, (doc, emb) in enumerate(zip(current_batch_docs, current_batch_embeddings)):
-                if emb is None:
-                    print(f"Erro: embedding para o documento no índice global {start_index + j} (batch index {j}) é None. Pulando.")
-                    all_successful = False 
-                    continue
-
-                payload = {
-                    "text": doc.page_content,
-                    "course_id": id_course, 
-                    **doc.metadata 
-                }
-                payload.setdefault('source', 'desconhecido')
-                payload.setdefault('page', -1)
-                point_id = str(uuid.uuid4())
-                points_to_insert.append(
-                    PointStruct(
-                        id=point_id,
-                        vector=emb,
-                        payload=payload
-                    )
-                )
+        print(f"Curso ID: {id_course}) Preparando para inserir/atualizar {total_docs} pontos em {num_batches} lotes de até {batch_size} pontos cada ({parallelism} em paralelo)...")
+
+        if sparse_embeddings is not None and len(sparse_embeddings) != total_docs:
+            print("Aviso: quantidade de embeddings esparsos diferente da de documentos. Ignorando vetores esparsos.")
+            sparse_embeddings = None
+        if not self.hybrid_enabled:
+            sparse_embeddings = None
+
+        # Cada lote recebe apenas fatias (views) de `documents`/`vectors`; os payloads são montados no worker
+        return [
+            (i + 1, num_batches,
+             documents[i * batch_size:(i + 1) * batch_size],
+             vectors[i * batch_size:(i + 1) * batch_size],
+             id_course, skip_unchanged,
+             sparse_embeddings[i * batch_size:(i + 1) * batch_size] if sparse_embeddings is not None else None)
+            for i in range(num_batches)
+        ]
+
+    def _finish_upsert(self, reports: List[Dict[str, Any]], id_course: str) -> bool:
+        """Registra os relatórios dos lotes, invalida o cache do curso e resume o resultado."""
+        num_batches = len(reports)
+        self.last_upsert_report = reports
+        course_payload_cache.invalidate(self.collection_name, id_course)
+        failed = [r for r in reports if not r["success"]]
+        retried = sum(1 for r in reports if r["attempts"] > 1)
+        upserted = sum(r["upserted"] for r in reports)
+        skipped = sum(r["skipped"] for r in reports)
+        all_successful = not failed
+
+        if all_successful:
+            print(f"Curso ID: {id_course} - Todos os {num_batches} lotes processados ({upserted} pontos enviados, {skipped} inalterados, {retried} lotes precisaram de nova tentativa).")
+        else:
+            print(f"Curso ID: {id_course} - Processamento de lotes concluído, mas {len(failed)}/{num_batches} lotes falharam: {[r['batch'] for r in failed]}")
+        return all_successful
 
-            if not points_to_insert:
-                print(f"Lote {i+1}/{num_batches}: Nenhum ponto válido para inserir. Pulando lote.")
-                continue
+    def _upsert_batch(self,
+                      batch_number: int,
+                      num_batches: int,
+                      batch_docs: List[Document],
+                      batch_vectors: np.ndarray,
+                      id_course: str,
+                      skip_unchanged: bool,
+                      batch_sparse: Optional[List[Any]] = None) -> Dict[str, Any]:
+        """Envia um lote ao Qdrant com novas tentativas (backoff exponencial) e retorna o relatório do lote."""
+        report = self._new_batch_report(batch_number, len(batch_docs))
+        ids, payloads = self._prepare_batch_payloads(batch_docs, id_course)
 
-            print(f"Lote {i+1}/{num_batches}: Inserindo/Atualizando {len(points_to_insert)} pontos...")
+        if skip_unchanged:
+            keep = self._changed_point_positions(ids, payloads)
+            report["skipped"] = len(ids) - len(keep)
+            if report["skipped"]:
+                print(f"Lote {batch_number}/{num_batches}: {report['skipped']} pontos inalterados ignorados.")
+            if not keep:
+                report["success"] = True
+                return report
+            if report["skipped"]:
+                ids, payloads, batch_vectors, batch_sparse = self._select_positions(keep, ids, payloads, batch_vectors, batch_sparse)
+
+        points = self._build_batch_points(ids, payloads, batch_vectors, batch_sparse)
+        max_attempts = 1 + max(0, settings.qdrant_upsert_max_retries)
+        for attempt in range(1, max_attempts + 1):
+            report["attempts"] = attempt
+            print(f"Lote {batch_number}/{num_batches}: Inserindo/Atualizando {len(ids)} pontos (tentativa {attempt}/{max_attempts})...")
             try:
                 operation_info = self.client.upsert(
                     collection_name=self.collection_name,
                     wait=True,
-                    points=points_to_insert
+                    points=points
                 )
-                print(f" -> Lote {i+1} Upsert Status: {operation_info.status}")
-                if operation_info.status != models.UpdateStatus.COMPLETED:
-                    all_successful = False
-                    print(f" -> AVISO: Lote {i+1} não foi completado com sucesso segundo o status retornado.")
+                print(f" -> Lote {batch_number} Upsert Status: {operation_info.status}")
+                if operation_info.status == models.UpdateStatus.COMPLETED:
+                    report["upserted"] = len(ids)
+                    report["success"] = True
+                    report["error"] = None
+                    return report
+                report["error"] = f"status {operation_info.status}"
+                print(f" -> AVISO: Lote {batch_number} não foi completado com sucesso segundo o status retornado.")
             except Exception as e:
-                print(f"Erro CRÍTICO durante o upsert do Lote {i+1}/{num_batches}: {type(e).__name__} - {e}")
+                report["error"] = f"{type(e).__name__} - {e}"
+                print(f"Erro durante o upsert do Lote {batch_number}/{num_batches}: {report['error']}")
                 # Adicionar mais detalhes do erro se possível, especialmente se for erro do Qdrant
                 if hasattr(e, 'details'):
                     print(f"   Detalhes do erro: {e.details}") 
                 elif hasattr(e, 'response_content'):
                     print(f"   Conteúdo da resposta do erro: {e.response_content}") 
+            if attempt < max_attempts:
+                time.sleep(settings.qdrant_upsert_retry_backoff_seconds * (2 ** (attempt - 1)))
 
-                all_successful = False
-        
-        if all_successful:
-            print(f"Curso ID: {id_course} - Todos os {num_batches} lotes processados (ou nenhum erro crítico encontrado).")
+        print(f"Erro CRÍTICO: Lote {batch_number}/{num_batches} falhou após {max_attempts} tentativas.")
+        return report
+
+    @staticmethod
+    def _new_batch_report(batch_number: int, num_points: int) -> Dict[str, Any]:
+        return {"batch": batch_number, "points": num_points, "upserted": 0, "skipped": 0,
+                "attempts": 0, "success": False, "error": None}
+
+    @staticmethod
+    def _prepare_batch_payloads(batch_docs: List[Document], id_course: str) -> tuple[List[str], List[Dict[str, Any]]]:
+        """Monta os IDs determinísticos e os payloads (com hash do conteúdo e modelo de embeddings) de um lote."""
+        ids: List[str] = []
+        payloads: List[Dict[str, Any]] = []
+        for doc in batch_docs:
+            payload = {
+                "text": doc.page_content,
+                "course_id": id_course, 
+                **doc.metadata 
+            }
+            payload.setdefault('source', 'desconhecido')
+            payload.setdefault('page', -1)
+            payload["content_hash"] = content_hash(doc.page_content)
+            payload["embedding_model"] = settings.embedding_model_name
+            ids.append(make_point_id(id_course, payload['source'], payload['page'],
+                                     payload.get('chunk_index'), payload["content_hash"]))
+            payloads.append(payload)
+        return ids, payloads
+
+    @staticmethod
+    def _select_positions(keep: List[int],
+                          ids: List[str],
+                          payloads: List[Dict[str, Any]],
+                          batch_vectors: np.ndarray,
+                          batch_sparse: Optional[List[Any]]) -> tuple:
+        """Mantém no lote apenas as posições em `keep`."""
+        return (
+            [ids[k] for k in keep],
+            [payloads[k] for k in keep],
+            batch_vectors[keep],
+            [batch_sparse[k] for k in keep] if batch_sparse is not None else None,
+        )
+
+    def _build_batch_points(self,
+                            ids: List[str],
+                            payloads: List[Dict[str, Any]],
+                            batch_vectors: np.ndarray,
+                            batch_sparse: Optional[List[Any]]) -> models.Batch:
+        # Fatia da matriz sem cópia no modo local; via REST precisa virar listas (só este lote)
+        dense_vectors = batch_vectors if self.is_local else batch_vectors.tolist()
+        if batch_sparse is not None:
+            vectors_struct = {
+                "": dense_vectors,
+                self.sparse_vector_name: [self._to_sparse_vector(e) for e in batch_sparse],
+            }
         else:
-            print(f"Curso ID: {id_course} - Processamento de lotes concluído, mas ocorreram erros ou avisos.")
-        return all_successful
+            vectors_struct = dense_vectors
+        return models.Batch(ids=ids, vectors=vectors_struct, payloads=payloads)
+
+    def _changed_point_positions(self, ids: List[str], payloads: List[Dict[str, Any]]) -> List[int]:
+        """Retorna as posições dos pontos novos ou cujo conteúdo (ou modelo de embeddings) mudou em relação ao já armazenado."""
+        try:
+            existing = self.client.retrieve(
+                collection_name=self.collection_name,
+                ids=ids,
+                with_payload=UNCHANGED_CHECK_FIELDS,
+                with_vectors=False
+            )
+        except Exception as e:
+            print(f"Aviso: não foi possível verificar pontos existentes ({type(e).__name__} - {e}). Reenviando o lote inteiro.")
+            return list(range(len(ids)))
+        return self._positions_with_new_content(existing, ids, payloads)
+
+    @staticmethod
+    def _positions_with_new_content(existing: List[Any], ids: List[str], payloads: List[Dict[str, Any]]) -> List[int]:
+        stored_payloads = {str(point.id): point.payload for point in existing}
+        return [
+            k for k, (point_id, payload) in enumerate(zip(ids, payloads))
+            if not is_unchanged_payload(stored_payloads.get(point_id), payload)
+        ]
+
+    def delete_points(self, id_course: str, point_ids: List[str], batch_size: int = 1000) -> bool:
+        """Remove pontos pelo ID (em lotes) e invalida o cache do curso."""
+        if not point_ids:
+            return True
+        success = True
+        for start in range(0, len(point_ids), batch_size):
+            batch_ids = point_ids[start:start + batch_size]
+            try:
+                self.client.delete(
+                    collection_name=self.collection_name,
+                    points_selector=models.PointIdsList(points=batch_ids),
+                    wait=True
+                )
+            except Exception as e:
+                print(f"Erro ao remover {len(batch_ids)} pontos do curso {id_course}: {type(e).__name__} - {e}")
+                success = False
+        course_payload_cache.invalidate(self.collection_name, id_course)
+        print(f"Curso ID: {id_course} - {len(point_ids)} pontos removidos{'' if success else ' (com falhas)'}.")
+        return success
+
+    def has_source(self, course_id: str, source: str) -> bool:
+        """Indica se já existem pontos indexados para o arquivo `source` do curso."""
+        try:
+            result = self.client.count(
+                collection_name=self.collection_name,
+                count_filter=models.Filter(
+                    must=[
+                        models.FieldCondition(key="course_id", match=models.MatchValue(value=course_id)),
+                        models.FieldCondition(key="source", match=models.MatchValue(value=source)),
+                    ]
+                ),
+                exact=True
+            )
+            return result.count > 0
+        except Exception as e:
+            print(f"Aviso: falha ao verificar se '{source}' já está indexado ({type(e).__name__} - {e}).")
+            return False
+
+    @staticmethod
+    def _to_sparse_vector(sparse: Any) -> models.SparseVector:
+        """Converte um embedding esparso (fastembed ou similar, com `indices`/`values`) para o modelo do Qdrant."""
+        if isinstance(sparse, models.SparseVector):
+            return sparse
+        return models.SparseVector(indices=np.asarray(sparse.indices).tolist(), values=np.asarray(sparse.values).tolist())
+
+    @staticmethod
+    def _payload_selector(payload_fields: Optional[Sequence[str]]) -> Any:
+        """Seletor de payload do Qdrant: None traz o payload inteiro, lista vazia nenhum campo."""
+        if payload_fields is None:
+            return True
+        return list(payload_fields) if payload_fields else False
+
+    def _vector_selector(self, with_vectors: bool) -> Any:
+        """Com vetores esparsos na coleção, pede só o denso (nome padrão "")."""
+        if with_vectors and self.hybrid_enabled:
+            return [""]
+        return with_vectors
+
+    @staticmethod
+    def _format_hit(hit: Any) -> SearchHit:
+        payload = dict(hit.payload or {})
+        vector = hit.vector.get("") if isinstance(hit.vector, dict) else hit.vector
+        return SearchHit(
+            id=hit.id,
+            score=hit.score,
+            text=payload.pop("text", ""),
+            source=payload.pop("source", "desconhecido"),
+            page=payload.pop("page", -1),
+            course_id=payload.pop("course_id", "desconhecido"),
+            extra=payload or None,
+            vector=np.asarray(vector, dtype=np.float32) if vector is not None else None
+        )
 
-    def search(self, query_vector: List[float], limit: int = 3, filter: Optional[models.Filter] = None) -> List[Dict[str, Any]]: # Mudei Dict para models.Filter
-        """Busca documentos relevantes no Qdrant, opcionalmente filtrando por course_id."""
+    def search(self,
+               query_vector: List[float],
+               limit: int = 3,
+               filter: Optional[models.Filter] = None,
+               oversampling: Optional[float] = None,
+               rescore: Optional[bool] = None,
+               sparse_vector: Optional[Any] = None,
+               payload_fields: Optional[Sequence[str]] = SEARCH_PAYLOAD_FIELDS,
+               with_vectors: bool = False) -> List[SearchHit]:
+        """
+        Busca documentos relevantes no Qdrant, opcionalmente filtrando por course_id.
+        `oversampling` e `rescore` só têm efeito com a coleção quantizada.
+        Com `sparse_vector` e a busca híbrida ativa, funde as buscas densa e
+        esparsa (BM25) por Reciprocal Rank Fusion.
+        `payload_fields` escolhe os campos do payload trazidos do Qdrant
+        (None = payload inteiro). Com `with_vectors`, cada resultado traz o
+        vetor denso armazenado (ex.: para re-ranqueamento MMR).
+        """
         if not query_vector: 
             print("Erro: Vetor de busca vazio.")
             return []
 
-        print(f"Buscando {limit} vizinhos mais próximos em '{self.collection_name}' com filtro: {filter}...")
+        query = SearchQuery(query_vector, limit, filter,
+                            sparse_vector if self.hybrid_enabled else None, payload_fields, with_vectors)
+        if query.sparse_vector is not None:
+            print(f"Busca híbrida (densa + {self.sparse_vector_name}, RRF) de {limit} documentos em '{self.collection_name}' com filtro: {filter}...")
+        else:
+            print(f"Buscando {limit} vizinhos mais próximos em '{self.collection_name}' com filtro: {filter}...")
         try:
-            search_result = self.client.search(
+            responses = self.client.query_batch_points(
                 collection_name=self.collection_name,
-                query_vector=query_vector,
-                query_filter=filter, 
-                limit=limit,
-                with_payload=True
+                requests=[self._build_query_request(query, self._build_search_params(oversampling, rescore))]
             )
-            # Formatar os resultados para serem mais consumíveis
-            results = []
-            for hit in search_result:
-                payload = hit.payload or {} 
-                results.append({
-                    "id": hit.id, 
-                    "text": payload.get("text", ""),
-                    "source": payload.get("source", "desconhecido"),
-                    "page": payload.get("page", -1),
-                    "course_id": payload.get("course_id", "desconhecido"), # Retornar course_id também
-                    "score": hit.score,
-                    "metadata": payload 
-                })
-            return results
+            return [self._format_hit(hit) for hit in responses[0].points]
         except Exception as e:
             print(f"Erro durante a busca vetorial: {type(e).__name__} - {e}")
             return []
 
-    def get_all_by_course_id(self, course_id_filter: str, limit: int = 1000, offset: Optional[Any] = None) -> List[Dict[str, Any]]: # Offset pode ser int ou UUID dependendo da versão
+    def search_batch(self,
+                     queries: List[SearchQuery],
+                     oversampling: Optional[float] = None,
+                     rescore: Optional[bool] = None) -> List[List[SearchHit]]:
         """
-        Recupera todos os documentos (apenas payload) para um course_id específico usando scroll.
-        Lida com paginação básica até o limite especificado.
+        Executa várias buscas em uma única requisição ao Qdrant, cada uma com
+        seu próprio filtro, limite e seleção de payload. Retorna uma lista de resultados por
+        consulta, na mesma ordem. Consultas com `sparse_vector` usam a busca
+        híbrida (RRF) quando ela está ativa.
         """
-        if not course_id_filter:
-            print("Erro: Filtro de ID do curso vazio.")
+        if not queries:
             return []
+        if any(not q.query_vector for q in queries):
+            print("Erro: search_batch recebeu consulta com vetor de busca vazio.")
+            return [[] for _ in queries]
 
-        print(f"Buscando todos os documentos em '{self.collection_name}' para course_id: {course_id_filter} com limite de {limit}...")
+        search_params = self._build_search_params(oversampling, rescore)
+        if not self.hybrid_enabled:
+            queries = [SearchQuery(q.query_vector, q.limit, q.filter, None, q.payload_fields, q.with_vectors) for q in queries]
+        use_hybrid = any(q.sparse_vector is not None for q in queries)
+        print(f"Busca em lote de {len(queries)} consultas em '{self.collection_name}' (híbrida: {use_hybrid})...")
+        try:
+            # Query API para todas as consultas (densas e híbridas); search/search_batch estão obsoletos no cliente
+            responses = self.client.query_batch_points(
+                collection_name=self.collection_name,
+                requests=[self._build_query_request(q, search_params) for q in queries]
+            )
+            return [[self._format_hit(hit) for hit in response.points] for response in responses]
+        except Exception as e:
+            print(f"Erro durante a busca vetorial em lote: {type(e).__name__} - {e}")
+            return [[] for _ in queries]
 
-        query_filter = models.Filter(
+    def _build_query_request(self, query: SearchQuery, search_params: Optional[models.SearchParams]) -> models.QueryRequest:
+        """Monta a requisição da Query API para uma consulta do lote (híbrida se houver vetor esparso)."""
+        if query.sparse_vector is None:
+            return models.QueryRequest(
+                query=query.query_vector,
+                filter=query.filter,
+                limit=query.limit,
+                params=search_params,
+                with_payload=self._payload_selector(query.payload_fields),
+                with_vector=self._vector_selector(query.with_vectors)
+            )
+        prefetch_limit = max(query.limit, settings.hybrid_prefetch_limit)
+        return models.QueryRequest(
+            prefetch=[
+                models.Prefetch(query=query.query_vector, filter=query.filter, limit=prefetch_limit, params=search_params),
+                models.Prefetch(
+                    query=self._to_sparse_vector(query.sparse_vector),
+                    using=self.sparse_vector_name,
+                    filter=query.filter,
+                    limit=prefetch_limit
+                ),
+            ],
+            query=models.FusionQuery(fusion=models.Fusion.RRF),
+            limit=query.limit,
+            with_payload=self._payload_selector(query.payload_fields),
+            with_vector=self._vector_selector(query.with_vectors)
+        )
+
+    @staticmethod
+    def _course_filter(course_id: str) -> models.Filter:
+        return models.Filter(
             must=[
                 models.FieldCondition(
                     key="course_id",
-                    match=models.MatchValue(value=course_id_filter)
+                    match=models.MatchValue(value=course_id)
                 )
             ]
         )
 
-        all_payloads: List[Dict[str, Any]] = []
-        current_offset = offset 
+    def iter_course_payloads(self,
+                             course_id: str,
+                             page_size: int = 100,
+                             fields: Optional[List[str]] = None,
+                             max_items: Optional[int] = None,
+                             offset: Optional[Any] = None) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Percorre os pontos de um curso via scroll, produzindo uma página
+        (lista de payloads com "id") por vez, sob demanda.
 
-        try:
-            while len(all_payloads) < limit:
-                scroll_batch_limit = min(100, limit - len(all_payloads))
-                if scroll_batch_limit <= 0:
-                    break
+        `fields` seleciona os campos do payload (ex.: ["text"]); lista vazia
+        retorna apenas os IDs. `max_items` limita o total produzido. Erros do
+        Qdrant são propagados ao chamador.
+        """
+        if fields is None:
+            with_payload: Any = True
+        elif not fields:
+            with_payload = False
+        else:
+            with_payload = list(fields)
 
-                scroll_response_tuple = self.client.scroll(
-                    collection_name=self.collection_name,
-                    scroll_filter=query_filter,
-                    limit=scroll_batch_limit,
-                    offset=current_offset,
-                    with_payload=True,
-                    with_vectors=False
-                )
-                points = scroll_response_tuple[0]
-                next_page_offset = scroll_response_tuple[1]
+        query_filter = self._course_filter(course_id)
+        current_offset = offset
+        produced = 0
+        while max_items is None or produced < max_items:
+            request_size = page_size if max_items is None else min(page_size, max_items - produced)
+            points, next_page_offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=query_filter,
+                limit=request_size,
+                offset=current_offset,
+                with_payload=with_payload,
+                with_vectors=False
+            )
+            page = [{"id": point.id, **(point.payload or {})} for point in points]
+            if page:
+                produced += len(page)
+                yield page
+            current_offset = next_page_offset
+            if not points or next_page_offset is None:
+                return
+
+    def get_all_by_course_id(self, course_id_filter: str, limit: int = 1000, offset: Optional[Any] = None) -> List[Dict[str, Any]]: # Offset pode ser int ou UUID dependendo da versão
+        """
+        Recupera todos os documentos (apenas payload) para um course_id específico usando scroll.
+        Lida com paginação básica até o limite especificado. Para cursos grandes,
+        prefira `iter_course_payloads`.
+        """
+        if not course_id_filter:
+            print("Erro: Filtro de ID do curso vazio.")
+            return []
 
-                for hit in points:
-                    if hit.payload:
-                        payload_to_return = {"id": hit.id, **hit.payload}
-                        all_payloads.append(payload_to_return) 
+        use_cache = offset is None
+        if use_cache:
+            cached = course_payload_cache.get(self.collection_name, course_id_filter, limit)
+            if cached is not None:
+                print(f"Cache: {len(cached)} documentos do course_id '{course_id_filter}' servidos da memória.")
+                return cached
+            cache_version = course_payload_cache.version(self.collection_name, course_id_filter)
 
-                current_offset = next_page_offset 
-                
-                if not points or next_page_offset is None:
-                    break 
+        print(f"Buscando todos os documentos em '{self.collection_name}' para course_id: {course_id_filter} com limite de {limit}...")
+
+        all_payloads: List[Dict[str, Any]] = []
+        try:
+            for page in self.iter_course_payloads(course_id_filter, page_size=100, max_items=limit, offset=offset):
+                # Mantém o comportamento anterior: pontos sem payload não são retornados
+                all_payloads.extend(p for p in page if len(p) > 1)
 
             print(f"Busca por scroll para course_id '{course_id_filter}' encontrou {len(all_payloads)} resultados.")
+            if use_cache:
+                course_payload_cache.put(
+                    self.collection_name, course_id_filter, all_payloads,
+                    # Abaixo do limite significa que o curso foi lido por inteiro
+                    complete=len(all_payloads) < limit, version=cache_version
+                )
             return all_payloads
 
         except Exception as e:
             print(f"Erro CRÍTICO durante a busca por scroll no Qdrant para course_id '{course_id_filter}': {type(e).__name__} - {e}")
             import traceback
             traceback.print_exc()
-            return []
\ No newline at end of file
+            return []
+
+
+def create_vector_store_service(vector_size: int):
+    """Instancia o backend de vetores configurado em VECTOR_STORE_BACKEND ('qdrant' ou 'numpy')."""
+    if settings.vector_store_backend == "numpy":
+        from services.numpy_vector_store_service import NumpyVectorStoreService
+        return NumpyVectorStoreService(vector_size=vector_size)
+    return VectorStoreService(vector_size=vector_size)
@@ -0,0 +1,51 @@
+# snapshot_data.py
+"""
+Exporta/importa snapshots da coleção do Qdrant (vetores + payloads).
+
+Exemplos:
+    python snapshot_data.py export --output /app/snapshots/full.npz
+    python snapshot_data.py export --course-id 4592 --output /app/snapshots/curso-4592.npz
+    python snapshot_data.py import /app/snapshots/full.npz
+"""
+import argparse
+import traceback
+
+from config.settings import settings
+from services.embedding_service import EmbeddingService
+from services.vector_store_service import VectorStoreService
+from services.snapshot_service import SnapshotService
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshots da coleção do Qdrant.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Exporta um curso ou a coleção inteira para um arquivo .npz.")
+    export_parser.add_argument("--course-id", help="Exporta apenas este course_id (padrão: coleção inteira).")
+    export_parser.add_argument("--output", required=True, help="Arquivo .npz de saída.")
+
+    import_parser = subparsers.add_parser("import", help="Restaura um snapshot .npz na coleção.")
+    import_parser.add_argument("path", help="Arquivo .npz gerado por 'export'.")
+    import_parser.add_argument("--only-if-empty", action="store_true",
+                               help="Não restaura se a coleção já tiver pontos.")
+    args = parser.parse_args()
+
+    # A dimensão vem dos metadados do modelo; não é preciso carregá-lo para mover vetores
+    vector_size = EmbeddingService._dimension_from_metadata(settings.embedding_model_name)
+    if vector_size is None:
+        vector_size = EmbeddingService().get_embedding_dimension()
+    snapshot_service = SnapshotService(VectorStoreService(vector_size=vector_size))
+
+    try:
+        if args.command == "export":
+            snapshot_service.export(args.output, course_id=args.course_id)
+        else:
+            snapshot_service.restore(args.path, only_if_empty=args.only_if_empty)
+    except Exception as e:
+        print(f"Erro CRÍTICO no snapshot: {type(e).__name__} - {e}")
+        traceback.print_exc()
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()